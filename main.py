@@ -4,10 +4,17 @@ import sys
 if __name__ == "__main__":
     print("Running main.py...")
 
-    if len(sys.argv) < 3:
-        print("Usage: python main.py <session_id> <bucket>")
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    sample = "--sample" in sys.argv[1:]
+    workers = next((arg.split("=", 1)[1] for arg in sys.argv[1:] if arg.startswith("--workers=")), "1")
+    workers = int(workers) if workers.isdigit() and int(workers) > 0 else None
+
+    if len(args) < 2 or workers is None:
+        print("Usage: python main.py <session_id> <bucket> [--sample | --workers=N]")
+    elif sample and workers > 1:
+        print("--sample and --workers=N cannot be combined: sampled runs are scored in a single process")
     else:
-        session_id = sys.argv[1]
-        bucket = sys.argv[2]
+        session_id = args[0]
+        bucket = args[1]
         print(f"Starting evaluation for session_id: {session_id}, bucket: {bucket}")
-        evaluate(session_id, bucket)
+        evaluate(session_id, bucket, sample=sample, workers=workers)
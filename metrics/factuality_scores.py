@@ -1,12 +1,23 @@
-from transformers import AutoModelForQuestionAnswering, AutoTokenizer
-import torch
+from metrics.text_features import has_knowledge_indicator
+from models import model_server, tuning
 
-# Load QA model
+# QA model, loaded on first in-process use
 model_name = "deepset/roberta-base-squad2"
-model = AutoModelForQuestionAnswering.from_pretrained(model_name)
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model.to(device)
+model = None
+tokenizer = None
+device = None
+
+def load_model():
+    global model, tokenizer, device
+    if model is None:
+        import torch
+        from transformers import AutoModelForQuestionAnswering, AutoTokenizer
+
+        model = AutoModelForQuestionAnswering.from_pretrained(model_name)
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        model.to(device)
+    return model, tokenizer
 
 def calculate_factuality_score(query, response):
     """
@@ -16,49 +27,82 @@ def calculate_factuality_score(query, response):
     This works by treating the response as context and the query as a question,
     then checking if the model can extract a consistent answer from the response.
     """
+    return calculate_factuality_scores([query], [response])[0]
+
+def calculate_factuality_scores(queries, responses):
+    """
+    Factuality scores for aligned lists of queries and responses.
+    Knowledge queries are scored in batches, by the model server sidecar
+    when it is running.
+    """
     # Only evaluate factuality for informational/knowledge queries
-    if not is_knowledge_query(query):
-        return 0.5  # Neutral score for non-knowledge queries
-    
-    try:
-        # Prepare input for the model
-        inputs = tokenizer(query, response, return_tensors="pt", max_length=512, 
-                          truncation=True, padding="max_length")
-        inputs = {k: v.to(device) for k, v in inputs.items()}
-        
-        # Get model predictions
-        with torch.no_grad():
-            outputs = model(**inputs)
-            start_scores = outputs.start_logits
-            end_scores = outputs.end_logits
-            
-            # Get the most likely answer span
-            start_idx = torch.argmax(start_scores)
-            end_idx = torch.argmax(end_scores)
-            
-            # Check if the answer span is valid
-            if end_idx >= start_idx:
+    scores = [0.5] * len(queries)  # Neutral score for non-knowledge queries
+    knowledge = [i for i, query in enumerate(queries) if is_knowledge_query(query)]
+    if not knowledge:
+        return scores
+
+    knowledge_queries = [queries[i] for i in knowledge]
+    knowledge_responses = [responses[i] for i in knowledge]
+    model_scores = model_server.remote_factuality(knowledge_queries, knowledge_responses)
+    if model_scores is None:
+        model_scores = factuality_model_scores(knowledge_queries, knowledge_responses)
+
+    for i, score in zip(knowledge, model_scores):
+        scores[i] = float(score)
+    return scores
+
+def factuality_model_scores(queries, responses, batch_size=None, strict=False):
+    """
+    QA-model factuality scores for knowledge queries, computed in-process
+    in batches of the tuned size. A failing batch scores 0.4, unless strict
+    is set (calibration), in which case the error is raised.
+    """
+    import torch
+    load_model()
+    tuning.configure("factuality")
+    batch_size = batch_size or tuning.batch_size("factuality")
+
+    scores = []
+    for start in range(0, len(queries), batch_size):
+        batch_queries = queries[start:start + batch_size]
+        batch_responses = responses[start:start + batch_size]
+        try:
+            # Prepare input for the model
+            inputs = tokenizer(batch_queries, batch_responses, return_tensors="pt", max_length=512,
+                              truncation=True, padding="max_length")
+            inputs = {k: v.to(device) for k, v in inputs.items()}
+
+            # Get model predictions
+            with torch.no_grad():
+                outputs = model(**inputs)
+                start_scores = outputs.start_logits
+                end_scores = outputs.end_logits
+
+                # Get the most likely answer span per pair
+                start_idx = torch.argmax(start_scores, dim=1)
+                end_idx = torch.argmax(end_scores, dim=1)
+
                 # Calculate confidence score (normalized)
-                confidence = torch.softmax(start_scores, dim=1).max().item() * \
-                             torch.softmax(end_scores, dim=1).max().item()
-                
-                # Higher confidence = higher factuality score
-                return min(1.0, confidence * 1.5)  # Scale up slightly but cap at 1.0
-            else:
-                return 0.3  # Low score for invalid spans
-    
-    except Exception as e:
-        print(f"Error in factuality evaluation: {e}")
-        return 0.4  # Default score on error
+                confidence = torch.softmax(start_scores, dim=1).max(dim=1).values * \
+                             torch.softmax(end_scores, dim=1).max(dim=1).values
+
+            for valid, conf in zip((end_idx >= start_idx).tolist(), confidence.tolist()):
+                if valid:
+                    # Higher confidence = higher factuality score
+                    scores.append(min(1.0, conf * 1.5))  # Scale up slightly but cap at 1.0
+                else:
+                    scores.append(0.3)  # Low score for invalid spans
+
+        except Exception as e:
+            if strict:
+                raise
+            print(f"Error in factuality evaluation: {e}")
+            scores.extend([0.4] * len(batch_queries))  # Default score on error
+
+    return scores
 
 def is_knowledge_query(query):
     """
     Determine if a query is seeking factual/knowledge information.
     """
-    knowledge_indicators = [
-        "what", "who", "when", "where", "why", "how", "explain", 
-        "tell me about", "information", "facts", "history", "define"
-    ]
-    
-    query_lower = query.lower()
-    return any(indicator in query_lower for indicator in knowledge_indicators)
\ No newline at end of file
+    return has_knowledge_indicator(query)
\ No newline at end of file
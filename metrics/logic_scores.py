@@ -1,27 +1,83 @@
-from sentence_transformers import SentenceTransformer, util
 import numpy as np
+from metrics.text_features import text_features, extract_features, keyword_coverage
+from models import model_server, tuning
 
-model = SentenceTransformer("all-MiniLM-L6-v2")
+# Sentence embedding model, loaded on first in-process use
+model_name = "all-MiniLM-L6-v2"
+model = None
+
+def load_model():
+    global model
+    if model is None:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(model_name)
+    return model
+
+def encode_local(texts, batch_size=None):
+    """
+    L2-normalized embeddings computed with the in-process model
+    in batches of the tuned size.
+    """
+    load_model()
+    tuning.configure("embedding")
+    return model.encode(texts, batch_size=batch_size or tuning.batch_size("embedding"),
+                        convert_to_numpy=True, normalize_embeddings=True)
+
+def encode(texts):
+    """
+    L2-normalized embeddings, from the model server sidecar when it is running.
+    """
+    embeddings = model_server.remote_embed(texts)
+    if embeddings is None:
+        embeddings = encode_local(texts)
+    return embeddings
 
 def semantic_similarity(text1, text2):
-    emb1 = model.encode(text1, convert_to_tensor=True)
-    emb2 = model.encode(text2, convert_to_tensor=True)
-    return util.cos_sim(emb1, emb2).item()
+    emb1, emb2 = encode([text1, text2])
+    return float(np.dot(emb1, emb2))
 
-def calculate_completeness_score(response):
-    words = len(response.split())
+def semantic_similarities(texts1, texts2):
+    """
+    Pairwise cosine similarity for two aligned lists of texts.
+    Each unique text is encoded once, in a single batch.
+    """
+    unique = list(set(texts1) | set(texts2))
+    index = {text: i for i, text in enumerate(unique)}
+    embeddings = encode(unique)
+    emb1 = embeddings[[index[t] for t in texts1]]
+    emb2 = embeddings[[index[t] for t in texts2]]
+    return np.einsum("ij,ij->i", emb1, emb2).tolist()
+
+def completeness_from_features(features):
+    words = features.token_count
     length_score = min(1.0, words / 50)
-    sentences = [s.strip() for s in response.split('.') if s.strip()]
-    complete_sentences = sum(1 for s in sentences if len(s.split()) >= 3)
-    structure_score = min(1.0, complete_sentences / max(1, len(sentences)))
-    unique_words = len(set(word.lower() for word in response.split()))
+    sentence_lengths = features.sentence_lengths
+    complete_sentences = sum(1 for n in sentence_lengths if n >= 3)
+    structure_score = min(1.0, complete_sentences / max(1, len(sentence_lengths)))
+    unique_words = features.unique_count
     density_score = min(1.0, unique_words / max(1, words) * 2)
     return (length_score * 0.4) + (structure_score * 0.3) + (density_score * 0.3)
 
+def calculate_completeness_score(response):
+    return completeness_from_features(text_features(response))
+
 def calculate_relevance_score(query, response):
     similarity = semantic_similarity(query, response)
-    query_keywords = set([word.lower() for word in query.split() if len(word) > 3])
-    response_words = [word.lower() for word in response.split()]
-    keywords_found = sum(1 for k in query_keywords if any(k in r for r in response_words))
-    keyword_coverage = keywords_found / len(query_keywords) if query_keywords else 0.5
-    return (similarity * 0.7) + (keyword_coverage * 0.3)
+    return (similarity * 0.7) + (keyword_coverage(query, response) * 0.3)
+
+def calculate_completeness_scores(responses):
+    """
+    Completeness scores for a whole session of responses.
+    """
+    return [completeness_from_features(f) for f in extract_features(responses)]
+
+def calculate_relevance_scores(queries, responses):
+    """
+    Relevance scores for aligned lists of queries and responses,
+    with all embeddings computed in one batched encode.
+    """
+    similarities = semantic_similarities(queries, responses)
+    return [
+        (similarity * 0.7) + (keyword_coverage(query, response) * 0.3)
+        for similarity, query, response in zip(similarities, queries, responses)
+    ]
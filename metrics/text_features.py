@@ -0,0 +1,62 @@
+import re
+from functools import lru_cache
+
+# Indicators of an informational/knowledge query (substring match)
+KNOWLEDGE_INDICATORS = [
+    "what", "who", "when", "where", "why", "how", "explain",
+    "tell me about", "information", "facts", "history", "define"
+]
+KNOWLEDGE_PATTERN = re.compile("|".join(re.escape(indicator) for indicator in KNOWLEDGE_INDICATORS))
+
+# Small: only the derived values are cached, and batches dedup on their own
+FEATURE_CACHE_SIZE = 4096
+
+def has_knowledge_indicator(text):
+    return KNOWLEDGE_PATTERN.search(text.lower()) is not None
+
+class TextFeatures:
+    """
+    Derived lexical values of one text, computed once and shared by every
+    metric. The text and its tokens are not retained.
+    """
+    __slots__ = ("token_count", "unique_count", "sentence_lengths")
+
+    def __init__(self, text):
+        tokens = text.split()
+        self.token_count = len(tokens)
+        self.unique_count = len(set(word.lower() for word in tokens))
+        # Word count of every non-empty '.'-delimited sentence
+        self.sentence_lengths = tuple(len(s.split()) for s in text.split('.') if s.strip())
+
+@lru_cache(maxsize=FEATURE_CACHE_SIZE)
+def text_features(text):
+    """
+    Cached TextFeatures for a text; repeated texts are only processed once.
+    """
+    return TextFeatures(text)
+
+def extract_features(texts):
+    """
+    Features for a whole batch of texts, deduplicated by text.
+    """
+    unique = {text: TextFeatures(text) for text in set(texts)}
+    return [unique[text] for text in texts]
+
+@lru_cache(maxsize=FEATURE_CACHE_SIZE)
+def query_keywords(query):
+    """
+    Lowercased query words long enough to count as keywords.
+    """
+    return frozenset(word.lower() for word in query.split() if len(word) > 3)
+
+def keyword_coverage(query, response):
+    """
+    Fraction of query keywords found inside any response word (0.5 if the
+    query has no keywords).
+    """
+    keywords = query_keywords(query)
+    if not keywords:
+        return 0.5
+    # Newline-joined so a substring search never spans two words
+    response_words = "\n".join(word.lower() for word in response.split())
+    return sum(1 for k in keywords if k in response_words) / len(keywords)
@@ -1,18 +1,50 @@
-import torch
-from transformers import AutoModelForSequenceClassification, AutoTokenizer
+from models import model_server, tuning
 
-# Detect device
-device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-
-# Load IBM Granite HAP model
+# IBM Granite HAP model, loaded on first in-process use
 model_name_or_path = 'ibm-granite/granite-guardian-hap-125m'
-model = AutoModelForSequenceClassification.from_pretrained(model_name_or_path)
-tokenizer = AutoTokenizer.from_pretrained(model_name_or_path)
-model.to(device)
+device = None
+model = None
+tokenizer = None
+
+def load_model():
+    global device, model, tokenizer
+    if model is None:
+        import torch
+        from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+        # Detect device
+        device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+
+        model = AutoModelForSequenceClassification.from_pretrained(model_name_or_path)
+        tokenizer = AutoTokenizer.from_pretrained(model_name_or_path)
+        model.to(device)
+    return model, tokenizer
+
+def hap_probabilities(texts, batch_size=None):
+    """
+    Harmful-class probability for each text, computed with the in-process model
+    in batches of the tuned size.
+    """
+    import numpy as np
+    import torch
+    load_model()
+    tuning.configure("hap")
+    batch_size = batch_size or tuning.batch_size("hap")
+
+    probs = []
+    for start in range(0, len(texts), batch_size):
+        inputs = tokenizer(texts[start:start + batch_size], padding=True, truncation=True, return_tensors="pt").to(device)
+
+        with torch.no_grad():
+            logits = model(**inputs).logits
+            probs.append(torch.softmax(logits, dim=1).cpu().numpy()[:, 1])  # class 1 = harmful
+
+    return np.concatenate(probs) if probs else np.zeros(0, dtype=np.float32)
 
 def invoke_hap(texts, threshold=0.5):
     """
     Evaluate harmfulness using Granite HAP model.
+    Uses the model server sidecar when it is running.
 
     Returns:
         List[Dict] → Each dict contains:
@@ -24,11 +56,9 @@ def invoke_hap(texts, threshold=0.5):
     if not isinstance(texts, list):
         texts = [texts]
 
-    inputs = tokenizer(texts, padding=True, truncation=True, return_tensors="pt").to(device)
-    
-    with torch.no_grad():
-        logits = model(**inputs).logits
-        probs = torch.softmax(logits, dim=1).cpu().numpy()[:, 1]  # class 1 = harmful
+    probs = model_server.remote_hap(texts)
+    if probs is None:
+        probs = hap_probabilities(texts)
 
     results = []
     for score in probs:
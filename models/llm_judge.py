@@ -1,5 +1,6 @@
 import boto3
 import json
+import math
 import re
 
 # Use the 'hari-work' named profile
@@ -8,6 +9,23 @@ bedrock = session.client("bedrock-runtime")
 
 MODEL_ID = "amazon.titan-text-premier-v1:0"
 
+# Token budgets: long queries/responses are cut to head and tail excerpts.
+# Budgets are approximate: tokens are estimated from characters, not counted
+# with the model's tokenizer.
+QUERY_TOKEN_BUDGET = 256
+RESPONSE_TOKEN_BUDGET = 1024
+HEAD_FRACTION = 0.67
+CHARS_PER_TOKEN = 4
+OMISSION_MARKER = "\n[... {omitted} characters omitted ...]\n"
+
+# The three-field JSON answer needs ~30 tokens; the rest is headroom so a
+# short preamble doesn't cut the JSON off (only generated tokens are billed)
+JUDGE_MAX_OUTPUT_TOKENS = 128
+
+# Titan Text Premier on-demand pricing (USD)
+INPUT_COST_PER_1K_TOKENS = 0.0005
+OUTPUT_COST_PER_1K_TOKENS = 0.0015
+
 def extract_json(text):
     """
     Extract the first valid JSON object from the model's output.
@@ -21,36 +39,78 @@ def extract_json(text):
     else:
         raise ValueError("No JSON object found in output.")
 
-def evaluate_with_llm(prompt, response):
+def estimate_tokens(text):
     """
-    Use Titan LLM to evaluate the response on relevance, completeness, and quality.
-    Scores range from 0.0 to 1.0.
+    Approximate token count (about 4 characters per token for English text).
+    This is a heuristic, not the model's tokenizer: code, numbers and
+    non-English text can use noticeably more tokens.
     """
-    eval_prompt = f"""
-You are an expert evaluator.
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
 
-Return only a valid JSON object. No explanation or comments. Score the agents response to the request.
+def trim_to_budget(text, token_budget):
+    """
+    Keep text within token_budget by taking head and tail excerpts cut at
+    word boundaries. The omission marker counts towards the budget, which
+    is approximate (see estimate_tokens). Returns (text, was_trimmed).
+    """
+    if estimate_tokens(text) <= token_budget:
+        return text, False
+
+    # Longest possible marker: the omitted count has at most len(text) digits
+    marker_chars = len(OMISSION_MARKER.format(omitted=len(text)))
+    char_budget = token_budget * CHARS_PER_TOKEN - marker_chars
+    if char_budget <= 0:
+        return text[:token_budget * CHARS_PER_TOKEN], True  # Budget too small for the marker
+    head_chars = int(char_budget * HEAD_FRACTION)
+    tail_chars = char_budget - head_chars
+    head = text[:head_chars].rsplit(" ", 1)[0]
+    tail = text[len(text) - tail_chars:].split(" ", 1)[-1]
+    omitted = len(text) - len(head) - len(tail)
+    return f"{head}{OMISSION_MARKER.format(omitted=omitted)}{tail}", True
+
+def build_judge_prompt(prompt, response, query_budget=QUERY_TOKEN_BUDGET, response_budget=RESPONSE_TOKEN_BUDGET):
+    """
+    Compact judge prompt with the query and response trimmed to their
+    (approximate) token budgets.
+    """
+    prompt, _ = trim_to_budget(prompt, query_budget)
+    response, trimmed = trim_to_budget(response, response_budget)
+    note = " The response is excerpted (beginning and end shown)." if trimmed else ""
 
-### Prompt:
-{prompt}
+    return f"""Score the response to the request from 0.0 to 1.0.{note}
+Return only a valid JSON object in this format. No explanation, comments or other text:
+{{"relevance": 0.00, "completeness": 0.00, "quality": 0.00}}
 
-### Response:
-{response}
+Request: {prompt}
 
-Score from 0.0 to 1.0 in the following format:
-{{
-  "relevance": 0.00,
-  "completeness": 0.00,
-  "quality": 0.00
-}}
+Response: {response}
 """
 
+def estimate_cost(input_tokens, output_tokens):
+    return round(input_tokens / 1000 * INPUT_COST_PER_1K_TOKENS + output_tokens / 1000 * OUTPUT_COST_PER_1K_TOKENS, 8)
+
+def evaluate_with_llm(prompt, response):
+    """
+    Use Titan LLM to evaluate the response on relevance, completeness, and quality.
+    Scores range from 0.0 to 1.0.
+    """
+    scores, _ = evaluate_with_llm_usage(prompt, response)
+    return scores
+
+def evaluate_with_llm_usage(prompt, response):
+    """
+    Like evaluate_with_llm, but also returns the token usage and estimated cost:
+    {"input_tokens", "output_tokens", "estimated_cost"}.
+    """
+    eval_prompt = build_judge_prompt(prompt, response)
+    usage = {"input_tokens": 0, "output_tokens": 0, "estimated_cost": 0.0}
+
     try:
         payload = {
             "inputText": eval_prompt,
             "textGenerationConfig": {
                 "temperature": 0.3,
-                "maxTokenCount": 400,
+                "maxTokenCount": JUDGE_MAX_OUTPUT_TOKENS,
                 "topP": 1,
                 "stopSequences": []
             }
@@ -66,11 +126,19 @@ Score from 0.0 to 1.0 in the following format:
 
         # Extract output text from Bedrock response
         output = json.loads(response["body"].read())
-        result_text = output.get("results", [{}])[0].get("outputText", "").strip()
+        result = output.get("results", [{}])[0]
+        result_text = result.get("outputText", "").strip()
+
+        # Token usage as reported by Bedrock, estimated if missing
+        input_tokens = output.get("inputTextTokenCount") or estimate_tokens(eval_prompt)
+        output_tokens = result.get("tokenCount") or estimate_tokens(result_text)
+        usage["input_tokens"] = input_tokens
+        usage["output_tokens"] = output_tokens
+        usage["estimated_cost"] = estimate_cost(input_tokens, output_tokens)
 
         # Extract and parse only the JSON portion
-        return extract_json(result_text)
+        return extract_json(result_text), usage
 
     except Exception as e:
         print(f"Bedrock LLM judge error: {e}")
-        return {"relevance": 0.0, "completeness": 0.0, "quality": 0.0}
+        return {"relevance": 0.0, "completeness": 0.0, "quality": 0.0}, usage
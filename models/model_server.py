@@ -0,0 +1,295 @@
+"""
+Local inference sidecar for the HAP, QA, embedding and PII models.
+
+Start it once with:
+
+    python -m models.model_server [socket_path]
+
+It loads every model up front and serves batched scoring requests over a
+Unix domain socket. hap_call, factuality_scores, logic_scores and
+presidio_call use it automatically when the socket is reachable and fall
+back to in-process models otherwise. Shard workers (main.py --workers=N)
+bypass it and load their own models, since it serves one request at a time.
+
+Wire format (all integers big-endian):
+    request  = op:uint8  length:uint32  payload
+    response = status:uint8  length:uint32  payload   (status 1 = error text)
+Strings are uint32 length + UTF-8 bytes, lists are uint32 count + items,
+scores and embeddings are raw float32.
+
+The socket lives in a per-user directory with mode 0700 ($XDG_RUNTIME_DIR
+or ~/.cache/hybrid-eval), so other local users can neither connect to it
+nor replace it. Clients give up on a request after MODEL_SERVER_TIMEOUT
+seconds and score in-process instead.
+"""
+import os
+import socket
+import socketserver
+import stat
+import struct
+import sys
+import threading
+from collections import namedtuple
+import numpy as np
+
+SOCKET_PATH = os.environ.get(
+    "HYBRID_EVAL_MODEL_SOCKET",
+    os.path.join(os.environ.get("XDG_RUNTIME_DIR") or os.path.join(os.path.expanduser("~"), ".cache"),
+                 "hybrid-eval", "models.sock")
+)
+
+# Seconds to wait on the server before scoring in-process
+MODEL_SERVER_TIMEOUT = float(os.environ.get("HYBRID_EVAL_MODEL_TIMEOUT", "300"))
+
+# Operations
+OP_HAP = 1
+OP_FACTUALITY = 2
+OP_EMBED = 3
+OP_PII = 4
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+HEADER = struct.Struct("!BI")
+COUNT = struct.Struct("!I")
+PII_ENTITY = struct.Struct("!IIf")
+
+PiiEntity = namedtuple("PiiEntity", ["entity_type", "start", "end", "score"])
+
+# ---------------------------------------------------------------------------
+# Encoding helpers
+
+def encode_strings(strings):
+    parts = [COUNT.pack(len(strings))]
+    for text in strings:
+        data = text.encode("utf-8")
+        parts.append(COUNT.pack(len(data)))
+        parts.append(data)
+    return b"".join(parts)
+
+def decode_strings(payload, offset=0):
+    (count,) = COUNT.unpack_from(payload, offset)
+    offset += COUNT.size
+    strings = []
+    for _ in range(count):
+        (length,) = COUNT.unpack_from(payload, offset)
+        offset += COUNT.size
+        strings.append(payload[offset:offset + length].decode("utf-8"))
+        offset += length
+    return strings, offset
+
+def encode_floats(values):
+    values = np.asarray(values, dtype=">f4")
+    return COUNT.pack(values.shape[0]) + values.tobytes()
+
+def decode_floats(payload):
+    (count,) = COUNT.unpack_from(payload, 0)
+    return np.frombuffer(payload, dtype=">f4", count=count, offset=COUNT.size).astype(np.float32)
+
+def encode_matrix(matrix):
+    matrix = np.asarray(matrix, dtype=">f4")
+    return struct.pack("!II", *matrix.shape) + matrix.tobytes()
+
+def decode_matrix(payload):
+    rows, cols = struct.unpack_from("!II", payload, 0)
+    return np.frombuffer(payload, dtype=">f4", count=rows * cols, offset=8).astype(np.float32).reshape(rows, cols)
+
+def encode_entities(per_text_entities):
+    parts = [COUNT.pack(len(per_text_entities))]
+    for entities in per_text_entities:
+        parts.append(COUNT.pack(len(entities)))
+        for entity in entities:
+            parts.append(encode_strings([entity.entity_type]))
+            parts.append(PII_ENTITY.pack(entity.start, entity.end, entity.score))
+    return b"".join(parts)
+
+def decode_entities(payload):
+    (count,) = COUNT.unpack_from(payload, 0)
+    offset = COUNT.size
+    results = []
+    for _ in range(count):
+        (n,) = COUNT.unpack_from(payload, offset)
+        offset += COUNT.size
+        entities = []
+        for _ in range(n):
+            (entity_type,), offset = decode_strings(payload, offset)
+            start, end, score = PII_ENTITY.unpack_from(payload, offset)
+            offset += PII_ENTITY.size
+            entities.append(PiiEntity(entity_type, start, end, score))
+        results.append(entities)
+    return results
+
+def read_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("model server closed the connection")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+def send_frame(sock, code, payload):
+    sock.sendall(HEADER.pack(code, len(payload)) + payload)
+
+def recv_frame(sock):
+    code, length = HEADER.unpack(read_exact(sock, HEADER.size))
+    return code, read_exact(sock, length)
+
+def is_private_dir(path):
+    """
+    True if path is a directory owned by this user and closed to everyone else.
+    """
+    try:
+        info = os.stat(path)
+    except OSError:
+        return False
+    return stat.S_ISDIR(info.st_mode) and info.st_uid == os.getuid() and not info.st_mode & 0o077
+
+# ---------------------------------------------------------------------------
+# Client
+
+client_socket = None
+server_available = None  # None = not checked yet
+
+def connect():
+    """
+    Connect to the sidecar once per process; returns None if it is not
+    running or its socket is not in a private directory.
+    """
+    global client_socket, server_available
+    if server_available is None:
+        server_available = False
+        if not is_private_dir(os.path.dirname(SOCKET_PATH)):
+            return None
+        try:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(MODEL_SERVER_TIMEOUT)
+            sock.connect(SOCKET_PATH)
+            client_socket = sock
+            server_available = True
+        except (OSError, AttributeError):
+            pass
+    return client_socket if server_available else None
+
+def call(op, payload):
+    """
+    Send one request to the sidecar and return the response payload, or
+    None if the sidecar is unavailable or failed the request (callers then
+    run in-process).
+    """
+    global server_available
+    sock = connect()
+    if sock is None:
+        return None
+
+    try:
+        send_frame(sock, op, payload)
+        status, response = recv_frame(sock)
+    except OSError as e:  # Includes socket.timeout
+        # A timed-out reply may still arrive, so the connection cannot be reused
+        print(f"Model server unavailable, falling back to in-process models: {e}")
+        server_available = False
+        sock.close()
+        return None
+
+    if status != STATUS_OK:
+        print(f"Model server error, scoring in-process instead: {response.decode('utf-8')}")
+        return None
+    return response
+
+def remote_hap(texts):
+    response = call(OP_HAP, encode_strings(texts))
+    return None if response is None else decode_floats(response)
+
+def remote_factuality(queries, responses):
+    pairs = [text for pair in zip(queries, responses) for text in pair]
+    response = call(OP_FACTUALITY, encode_strings(pairs))
+    return None if response is None else decode_floats(response)
+
+def remote_embed(texts):
+    response = call(OP_EMBED, encode_strings(texts))
+    return None if response is None else decode_matrix(response)
+
+def remote_pii(texts):
+    response = call(OP_PII, encode_strings(texts))
+    return None if response is None else decode_entities(response)
+
+# ---------------------------------------------------------------------------
+# Server
+
+def handle_request(op, payload):
+    from models import hap_call, presidio_call
+    from metrics import factuality_scores, logic_scores
+
+    texts, _ = decode_strings(payload)
+    if op == OP_HAP:
+        return encode_floats(hap_call.hap_probabilities(texts))
+    if op == OP_FACTUALITY:
+        queries, responses = texts[0::2], texts[1::2]
+        return encode_floats(factuality_scores.factuality_model_scores(queries, responses))
+    if op == OP_EMBED:
+        return encode_matrix(logic_scores.encode_local(texts))
+    if op == OP_PII:
+        return encode_entities([
+            [PiiEntity(r.entity_type, r.start, r.end, r.score) for r in presidio_call.analyze_local(text)]
+            for text in texts
+        ])
+    raise ValueError(f"Unknown operation: {op}")
+
+# Model calls are serialized so concurrent clients never compete for cores
+inference_lock = threading.Lock()
+
+class ModelRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                op, payload = recv_frame(self.request)
+            except ConnectionError:
+                return
+            try:
+                with inference_lock:
+                    response = handle_request(op, payload)
+                send_frame(self.request, STATUS_OK, response)
+            except Exception as e:
+                send_frame(self.request, STATUS_ERROR, str(e).encode("utf-8"))
+
+class ModelServer(socketserver.ThreadingUnixStreamServer):
+    # Clients keep their connection open; don't wait for them on shutdown
+    daemon_threads = True
+    block_on_close = False
+
+def serve(socket_path=SOCKET_PATH):
+    """
+    Load every model and serve requests until interrupted.
+    """
+    from models import hap_call, presidio_call
+    from metrics import factuality_scores, logic_scores
+
+    print("Loading models...")
+    hap_call.load_model()
+    factuality_scores.load_model()
+    logic_scores.load_model()
+    presidio_call.load_analyzer()
+
+    socket_dir = os.path.dirname(socket_path)
+    os.makedirs(socket_dir, mode=0o700, exist_ok=True)
+    if not is_private_dir(socket_dir):
+        raise RuntimeError(f"{socket_dir} must be owned by this user with mode 0700")
+    if os.path.lexists(socket_path):
+        if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+            raise RuntimeError(f"{socket_path} exists and is not a socket")
+        os.unlink(socket_path)
+
+    with ModelServer(socket_path, ModelRequestHandler) as server:
+        os.chmod(socket_path, 0o600)
+        print(f"Model server listening on {socket_path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(socket_path)
+
+if __name__ == "__main__":
+    serve(sys.argv[1] if len(sys.argv) > 1 else SOCKET_PATH)
@@ -1,9 +1,28 @@
-from presidio_analyzer import AnalyzerEngine
+from models import model_server
 
-analyzer = AnalyzerEngine()
+PII_ENTITIES = ["PHONE_NUMBER", "EMAIL_ADDRESS", "CREDIT_CARD", "IP_ADDRESS", "DATE_TIME", "PERSON", "LOCATION", "URL"]
+
+# Presidio analyzer (spaCy pipeline), created on first in-process use
+analyzer = None
+
+def load_analyzer():
+    global analyzer
+    if analyzer is None:
+        from presidio_analyzer import AnalyzerEngine
+        analyzer = AnalyzerEngine()
+    return analyzer
+
+def analyze_local(text):
+    return load_analyzer().analyze(text=text, entities=PII_ENTITIES, language='en')
 
 def invoke_presidio(text):
-    results = analyzer.analyze(text=text,
-                           entities=["PHONE_NUMBER", "EMAIL_ADDRESS", "CREDIT_CARD", "IP_ADDRESS", "DATE_TIME", "PERSON", "LOCATION", "URL"],
-                           language='en')
+    return invoke_presidio_batch([text])[0]
+
+def invoke_presidio_batch(texts):
+    """
+    PII entities for each text, in one model server request when it is running.
+    """
+    results = model_server.remote_pii(texts)
+    if results is None:
+        return [analyze_local(text) for text in texts]
     return results
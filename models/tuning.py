@@ -0,0 +1,271 @@
+"""
+Batch-size and thread-count tuning for CPU inference.
+
+Calibrate once per host type with:
+
+    python -m models.tuning [session.json]
+
+This measures throughput of the HAP, QA and embedding models across batch
+sizes, torch.set_num_threads values and inter-op thread counts, and saves
+the best configuration for this host type to the profile file. The batched
+scoring paths in hap_call, factuality_scores and logic_scores then pick it
+up automatically.
+
+Inter-op threads can only be set once per process, so every
+(threads, inter-op threads) combination is measured in its own subprocess.
+"""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+PROFILE_PATH = os.environ.get(
+    "HYBRID_EVAL_TUNING_PROFILE",
+    os.path.join(os.path.expanduser("~"), ".cache", "hybrid-eval", "inference_profile.json")
+)
+
+MODELS = ["hap", "factuality", "embedding"]
+
+# Used when no profile exists for this host
+DEFAULT_BATCH_SIZES = {"hap": 32, "factuality": 8, "embedding": 32}
+
+CALIBRATION_BATCH_SIZES = [1, 4, 8, 16, 32, 64]
+CALIBRATION_INTEROP_THREADS = [1, 2]
+MIN_TIMED_TEXTS = 64  # Texts scored per measurement (at least 2 batches)
+MEASURE_REPEATS = 5   # Timed runs per measurement; the median is kept
+
+# Cached profile for this host; None = not loaded yet
+profile = None
+applied_interop_threads = False
+
+# Per-process thread cap (see limit_threads); None = no cap
+max_threads = None
+
+def host_key():
+    """
+    Identify the host type: CPU architecture, core count and accelerator.
+    """
+    accelerator = "cpu"
+    try:
+        import torch
+        if torch.cuda.is_available():
+            accelerator = torch.cuda.get_device_name(0).replace(" ", "_")
+    except ImportError:
+        pass
+    return f"{platform.machine()}-{os.cpu_count()}cpu-{accelerator}"
+
+def load_profile(path=PROFILE_PATH):
+    """
+    Tuned settings for this host type, or an empty dict if not calibrated.
+    """
+    global profile
+    if profile is None:
+        try:
+            with open(path) as f:
+                profile = json.load(f).get(host_key(), {})
+        except (OSError, json.JSONDecodeError):
+            profile = {}
+    return profile
+
+def batch_size(model_key):
+    """
+    Batch size to use for a model's batched scoring path.
+    """
+    return load_profile().get(model_key, {}).get("batch_size", DEFAULT_BATCH_SIZES[model_key])
+
+def limit_threads(num_threads):
+    """
+    Cap the torch threads used in this process, e.g. for one of several
+    shard workers sharing the host. Applied lazily by configure(), so a
+    process that only talks to the model server never imports torch.
+    """
+    global max_threads
+    max_threads = num_threads
+    for var in ["OMP_NUM_THREADS", "MKL_NUM_THREADS"]:
+        os.environ[var] = str(num_threads)
+
+def configure(model_key):
+    """
+    Apply the tuned torch thread settings for a model before running it,
+    capped by limit_threads(). Does nothing when this host has not been
+    calibrated and no cap is set.
+    """
+    global applied_interop_threads
+    settings = load_profile().get(model_key)
+    if not settings and max_threads is None:
+        return
+
+    import torch
+    if not applied_interop_threads:
+        applied_interop_threads = True
+        interop_threads = load_profile().get("interop_threads", 1 if max_threads else None)
+        if interop_threads:
+            try:
+                torch.set_num_interop_threads(min(interop_threads, max_threads or interop_threads))
+            except RuntimeError:
+                pass  # Already fixed by earlier parallel work in this process
+
+    num_threads = settings["num_threads"] if settings else max_threads
+    if max_threads:
+        num_threads = min(num_threads, max_threads)
+    if torch.get_num_threads() != num_threads:
+        torch.set_num_threads(num_threads)
+
+def calibration_texts(count, session_path=None):
+    """
+    Query/response pairs to time with, taken from a session file if given.
+    """
+    pairs = []
+    if session_path:
+        with open(session_path) as f:
+            for row in json.load(f):
+                response = row.get("prodagent_response", row.get("agent_response", ""))
+                pairs.append((row["request"], response))
+    if not pairs:
+        sentence = "The evaluation pipeline scores agent responses for relevance and safety. "
+        pairs = [(f"What does the pipeline do in case {i}?", sentence * (1 + i % 12)) for i in range(count)]
+    return [pairs[i % len(pairs)] for i in range(count)]
+
+def measure(run, texts, batch_size, repeats=MEASURE_REPEATS):
+    """
+    Texts per second for run(texts, batch_size) after one warm-up batch,
+    from the median of repeats timed runs.
+    """
+    run(texts[:batch_size], batch_size)
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run(texts, batch_size)
+        timings.append(time.perf_counter() - start)
+    return len(texts) / statistics.median(timings)
+
+def calibrate_worker(num_threads, interop_threads, batch_sizes, session_path=None):
+    """
+    Measure every model and batch size under one thread configuration.
+    Runs in a fresh subprocess; returns {model: {batch_size: throughput}},
+    with None for a batch size whose model call failed (e.g. out of memory).
+    Models are called without their error fallbacks, so a failing batch is
+    never timed as a fast fallback score.
+    """
+    global profile
+    import torch
+    torch.set_num_interop_threads(interop_threads)
+    torch.set_num_threads(num_threads)
+    profile = {}  # Measure raw settings, never a previously saved profile
+
+    from models import hap_call
+    from metrics import factuality_scores, logic_scores
+
+    runners = {
+        "hap": lambda pairs, bs: hap_call.hap_probabilities([r for _, r in pairs], batch_size=bs),
+        "factuality": lambda pairs, bs: factuality_scores.factuality_model_scores(
+            [q for q, _ in pairs], [r for _, r in pairs], batch_size=bs, strict=True),
+        "embedding": lambda pairs, bs: logic_scores.encode_local([r for _, r in pairs], batch_size=bs),
+    }
+
+    results = {}
+    for model_key, run in runners.items():
+        results[model_key] = {}
+        for bs in batch_sizes:
+            texts = calibration_texts(max(MIN_TIMED_TEXTS, 2 * bs), session_path)
+            try:
+                results[model_key][bs] = measure(run, texts, bs)
+            except Exception as e:
+                print(f"{model_key} failed at batch size {bs}: {e}", file=sys.stderr)
+                results[model_key][bs] = None
+    return results
+
+def thread_counts():
+    """
+    Candidate intra-op thread counts: powers of two up to the core count.
+    """
+    cores = os.cpu_count() or 1
+    counts = []
+    n = 1
+    while n < cores:
+        counts.append(n)
+        n *= 2
+    counts.append(cores)
+    return counts
+
+def calibrate(session_path=None, batch_sizes=None, num_threads=None, interop_threads=None, path=PROFILE_PATH):
+    """
+    Find the fastest batch size and thread count per model for this host
+    type and save it to the profile file.
+    """
+    batch_sizes = batch_sizes or CALIBRATION_BATCH_SIZES
+    num_threads = num_threads or thread_counts()
+    interop_threads = interop_threads or CALIBRATION_INTEROP_THREADS
+
+    measurements = []
+    for interop in interop_threads:
+        for threads in num_threads:
+            print(f"Calibrating threads={threads}, interop_threads={interop}...")
+            cmd = [sys.executable, "-m", "models.tuning", "--worker", str(threads), str(interop),
+                   ",".join(map(str, batch_sizes))]
+            if session_path:
+                cmd.append(session_path)
+            process = subprocess.run(cmd, capture_output=True, text=True)
+            if process.returncode != 0:
+                # e.g. killed for running out of memory: the configuration is unusable
+                print(f"Calibration worker failed (exit code {process.returncode}), skipping configuration")
+                continue
+            measurements.append((threads, interop, json.loads(process.stdout.strip().splitlines()[-1])))
+
+    # Best throughput per model across all valid configurations
+    host_profile = {}
+    for model_key in MODELS:
+        candidates = [(throughput, threads, interop, int(bs))
+                      for threads, interop, result in measurements
+                      for bs, throughput in result[model_key].items() if throughput is not None]
+        if not candidates:
+            raise RuntimeError(f"No valid calibration measurement for {model_key}")
+        best = max(candidates, key=lambda item: item[0])
+        host_profile[model_key] = {
+            "batch_size": best[3],
+            "num_threads": best[1],
+            "interop_threads": best[2],
+            "throughput": round(best[0], 2)
+        }
+
+    # Inter-op threads are process-wide: keep the value with the best combined
+    # throughput relative to each model's best
+    def relative_score(interop):
+        return sum(
+            max((t for _, i, result in measurements if i == interop for t in result[m].values() if t is not None),
+                default=0.0) / host_profile[m]["throughput"]
+            for m in MODELS
+        )
+    host_profile["interop_threads"] = max(interop_threads, key=relative_score)
+
+    save_profile(host_profile, path)
+    return host_profile
+
+def save_profile(host_profile, path=PROFILE_PATH):
+    """
+    Store the profile for this host type, keeping other host types' entries.
+    """
+    global profile
+    try:
+        with open(path) as f:
+            profiles = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        profiles = {}
+
+    profiles[host_key()] = host_profile
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(profiles, f, indent=2)
+    profile = host_profile
+    print(f"Saved inference profile for {host_key()} to {path}")
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 5 and sys.argv[1] == "--worker":
+        session = sys.argv[5] if len(sys.argv) > 5 else None
+        sizes = [int(bs) for bs in sys.argv[4].split(",")]
+        print(json.dumps(calibrate_worker(int(sys.argv[2]), int(sys.argv[3]), sizes, session)))
+    else:
+        print(json.dumps(calibrate(sys.argv[1] if len(sys.argv) > 1 else None), indent=2))
@@ -1,129 +1,180 @@
+import json
 from models import hap_call, presidio_call, llm_judge
 from utils import insight_generator
-from utils.s3_helper import load_session_data, save_evaluation_results
-from metrics.logic_scores import calculate_completeness_score, calculate_relevance_score
-from metrics.factuality_scores import calculate_factuality_score  # Add this import
+from utils.s3_helper import load_session_data, save_evaluation_stream
+from metrics.logic_scores import calculate_completeness_scores, calculate_relevance_scores
+from metrics.factuality_scores import calculate_factuality_scores
+from utils.sampling import row_strata, stratified_order
+from utils.result_store import EvaluationResults
+from utils import score_history
+from pipeline.sharding import evaluate_sharded
+
+# Rows scored together by the batched model paths
+SCORING_BATCH_SIZE = 1000
+
+# Sampling mode settings
+SAMPLE_BATCH_SIZE = 200
+MIN_SAMPLE_SIZE = 400
+MAX_SAMPLE_SIZE = 20000
+CI_TOLERANCE = 0.05  # Max CI half-width on overall scores before stopping early
+CI_CHECK_GROWTH = 1.5  # Sample size growth between bootstrap checks
+
+def agent_responses(row):
+    """
+    (agent, response) pairs to score for a session row.
+    """
+    if "prodagent_response" in row and "shadagent_response" in row:
+        return [("prodagent", row["prodagent_response"]), ("shadagent", row["shadagent_response"])]
+    return [("agent", row["agent_response"])]
+
+def batch_scores(rows):
+    """
+    Completeness, relevance, factuality, HAP and PII results for every agent
+    response in rows, computed over the whole batch so text features are
+    shared and the models run in tuned batches.
+    Returns one {agent: {...}} dict per row.
+    """
+    pairs = [(i, agent, row["request"], response)
+             for i, row in enumerate(rows) for agent, response in agent_responses(row)]
+    queries = [query for _, _, query, _ in pairs]
+    responses = [response for _, _, _, response in pairs]
+
+    completeness = calculate_completeness_scores(responses)
+    relevance = calculate_relevance_scores(queries, responses)
+    factuality = calculate_factuality_scores(queries, responses)
+    hap_results = hap_call.invoke_hap(responses) if responses else []
+    pii_results = presidio_call.invoke_presidio_batch(responses) if responses else []
+
+    scores = [{} for _ in rows]
+    for (i, agent, _, _), c, r, f, hap, pii in zip(pairs, completeness, relevance, factuality, hap_results, pii_results):
+        scores[i][agent] = {"completeness": c, "relevance": r, "factuality": f, "hap": hap, "pii_count": len(pii)}
+    return scores
+
+def evaluate_rows(rows, indices, results):
+    """
+    Score the session rows at indices and append them to results.
+    """
+    batch = [rows[i] for i in indices]
+    precomputed = batch_scores(batch)
+    for index, row, scores in zip(indices, batch, precomputed):
+        results.append(index, evaluate_row(row, scores))
+
+def evaluate_row(row, precomputed):
+    """
+    Score a single session row and return its evaluation per agent.
+    precomputed holds the batch-computed logic, HAP and PII results per agent.
+    """
+    query = row["request"]
+    evaluation = {}
+
+    for agent, response in agent_responses(row):
+        # HAP evaluation
+        hap_result = precomputed[agent]["hap"]
+
+        # Logic scores
+        logic_score = {
+            "completeness": precomputed[agent]["completeness"],
+            "relevance": precomputed[agent]["relevance"],
+            "factuality": precomputed[agent]["factuality"]
+        }
+
+        # LLM scores
+        llm_scores, llm_usage = llm_judge.evaluate_with_llm_usage(query, response)
+
+        evaluation[agent] = {
+            "logic": logic_score,
+            "llm": llm_scores,
+            "harmfulness_score": hap_result["score"],
+            "unsafe": bool(hap_result["unsafe"]),
+            "pii_count": precomputed[agent]["pii_count"],
+            "llm_usage": llm_usage
+        }
+
+    return evaluation
+
+def evaluate_sampled(db, batch_size=SAMPLE_BATCH_SIZE, min_samples=MIN_SAMPLE_SIZE,
+                     ci_tolerance=CI_TOLERANCE, max_samples=MAX_SAMPLE_SIZE, seed=0):
+    """
+    Score a stratified sample of the session instead of every row.
+
+    Rows are drawn in stratified order (time bucket, query type, response
+    length band) one batch at a time; sampling stops once the bootstrap
+    intervals on the overall scores are within ci_tolerance, or when
+    max_samples rows have been scored. The bootstrap is rerun each time the
+    sample has grown by CI_CHECK_GROWTH, so its total cost stays linear in
+    the sample size.
+    """
+    ordered, strata_count = stratified_order(db, seed=seed)
+    strata = row_strata(db)
+    limit = min(len(ordered), max_samples) if max_samples else len(ordered)
+
+    results = EvaluationResults(db, capacity=limit)
+    half_width = float("inf")
+    next_check = min_samples
+    while len(results) < limit:
+        evaluate_rows(db, ordered[len(results):min(limit, len(results) + batch_size)], results)
+
+        if len(results) >= next_check:
+            next_check = int(len(results) * CI_CHECK_GROWTH)
+            intervals = insight_generator.bootstrap_confidence_intervals(results, seed=seed, strata=strata)
+            half_width = insight_generator.max_interval_half_width(intervals, results.is_dual_agent)
+            print(f"Sampled {len(results)}/{len(db)} rows, CI half-width: {half_width:.4f}")
+            if half_width <= ci_tolerance:
+                break
+
+    sampling_info = {
+        "population_size": len(db),
+        "sample_size": len(results),
+        "strata": strata_count,
+        "ci_tolerance": ci_tolerance,
+        "ci_half_width": round(half_width, 4) if half_width != float("inf") else None,
+        "stopped_early": len(results) < limit
+    }
 
-def evaluate(session_id, bucket):
+    # Rows were scored in stratified (shuffled) order; restore session order
+    # so the output and the in-session drift analysis follow time
+    results = EvaluationResults.merge_fragments(db, [results.fragment()])
+    return results, sampling_info
+
+def output_chunks(results, insights):
+    """
+    The {"evaluation_results": ..., "insights": ...} output document as JSON
+    text chunks, encoding one result entry at a time.
+    """
+    yield '{\n  "evaluation_results": '
+    yield from results.iter_json(indent=2, level=1)
+    yield ',\n  "insights": ' + json.dumps(insights, indent=2).replace("\n", "\n  ") + "\n}"
+
+def evaluate(session_id, bucket, sample=False, workers=1):
     db = load_session_data(session_id, bucket)
     if not db:
         return
 
-    results = []
-
-    for row in db:
-        query = row["request"]
-        request_id = row["request_id"]
-        
-        # Add timestamp and session_id to results for temporal tracking
-        timestamp = row.get("unix_timestamp")
-        readable_time = row.get("readable_timestamp")
-
-        # Determine if we're in single or dual agent mode
-        is_dual_agent = "prodagent_response" in row and "shadagent_response" in row
-
-        if is_dual_agent:
-            # Dual agent evaluation
-            prod_response = row["prodagent_response"]
-            shad_response = row["shadagent_response"]
-
-            # HAP evaluation
-            hap_result_prod = hap_call.invoke_hap(prod_response)[0]
-            hap_result_shad = hap_call.invoke_hap(shad_response)[0]
-
-            # Presidio PII detection
-            pii_prod = presidio_call.invoke_presidio(prod_response)
-            pii_shad = presidio_call.invoke_presidio(shad_response)
-
-            # Logic scores
-            logic_score_prod = {
-                "completeness": calculate_completeness_score(prod_response),
-                "relevance": calculate_relevance_score(query, prod_response),
-                "factuality": calculate_factuality_score(query, prod_response)
-            }
-            logic_score_shad = {
-                "completeness": calculate_completeness_score(shad_response),
-                "relevance": calculate_relevance_score(query, shad_response),
-                "factuality": calculate_factuality_score(query, shad_response)
-            }
-
-            # LLM scores
-            llm_scores_prod = llm_judge.evaluate_with_llm(query, prod_response)
-            llm_scores_shad = llm_judge.evaluate_with_llm(query, shad_response)
-
-            # Combine results
-            results.append({
-                "request_id": request_id,
-                "session_id": row.get("session_id"),
-                "timestamp": timestamp,
-                "readable_timestamp": readable_time,
-                "query": query,
-                "prod_response": prod_response,
-                "shad_response": shad_response,
-                "evaluation": {
-                    "prodagent": {
-                        "logic": logic_score_prod,
-                        "llm": llm_scores_prod,
-                        "harmfulness_score": hap_result_prod["score"],
-                        "unsafe": bool(hap_result_prod["unsafe"]),
-                        "pii_count": len(pii_prod)
-                    },
-                    "shadagent": {
-                        "logic": logic_score_shad,
-                        "llm": llm_scores_shad,
-                        "harmfulness_score": hap_result_shad["score"],
-                        "unsafe": bool(hap_result_shad["unsafe"]),
-                        "pii_count": len(pii_shad)
-                    }
-                }
-            })
-        else:
-            # Single agent evaluation
-            agent_response = row["agent_response"]
-
-            # HAP evaluation
-            hap_result = hap_call.invoke_hap(agent_response)[0]
-
-            # Presidio PII detection
-            pii = presidio_call.invoke_presidio(agent_response)
-
-            # Logic scores
-            logic_score = {
-                "completeness": calculate_completeness_score(agent_response),
-                "relevance": calculate_relevance_score(query, agent_response),
-                "factuality": calculate_factuality_score(query, agent_response)
-            }
-
-            # LLM scores
-            llm_scores = llm_judge.evaluate_with_llm(query, agent_response)
-
-            # Combine results
-            results.append({
-                "request_id": request_id,
-                "session_id": row.get("session_id"),
-                "timestamp": timestamp,
-                "readable_timestamp": readable_time,
-                "query": query,
-                "agent_response": agent_response,
-                "evaluation": {
-                    "agent": {
-                        "logic": logic_score,
-                        "llm": llm_scores,
-                        "harmfulness_score": hap_result["score"],
-                        "unsafe": bool(hap_result["unsafe"]),
-                        "pii_count": len(pii)
-                    }
-                }
-            })
+    if sample:
+        results, sampling_info = evaluate_sampled(db)
+    elif workers > 1:
+        results = evaluate_sharded(db, workers)
+    else:
+        results = EvaluationResults(db)
+        for start in range(0, len(db), SCORING_BATCH_SIZE):
+            evaluate_rows(db, range(start, min(len(db), start + SCORING_BATCH_SIZE)), results)
 
     # Generate high-level insights across all entries
-    insights = insight_generator.generate_insights(results)
-
-    final_output = {
-        "evaluation_results": results,
-        "insights": insights
-    }
-
-    save_evaluation_results(session_id, final_output, bucket)
+    insights = insight_generator.generate_insights(results, bootstrap=sample, population_size=len(db),
+                                                   strata=row_strata(db) if sample else None)
+    if sample:
+        insights["sampling"] = sampling_info
+
+    # Append to the local cross-session score history
+    try:
+        score_history.record_results(results, sampled=sample)
+        insights["historical_analysis"] = {
+            "drift": score_history.drift_status(),
+            "weekly_deltas": score_history.weekly_agent_deltas()[-4:] if results.is_dual_agent else []
+        }
+    except Exception as e:
+        print(f"Error updating score history: {e}")
+
+    save_evaluation_stream(session_id, output_chunks(results, insights), bucket)
     print("Evaluation complete.")
     print("Summary:", insights["summary"])
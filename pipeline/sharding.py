@@ -0,0 +1,171 @@
+"""
+Intra-session sharding: split one session across worker processes and
+merge the shard results back into a single-node-identical result.
+
+Rows are assigned to shards by a stable hash of their request_id. Each
+worker process scores its shard and returns the compact result arrays plus
+partial aggregates. A shard whose worker fails, or returns rows other than
+the ones it was assigned, is reassigned up to MAX_SHARD_ATTEMPTS times.
+Local processes stand in for remote nodes; a remote dispatcher only needs
+to provide the same shard_worker contract.
+"""
+import multiprocessing
+import os
+import zlib
+from collections import deque
+from multiprocessing.connection import wait
+import numpy as np
+from utils.result_store import EvaluationResults, session_agents
+
+MAX_SHARD_ATTEMPTS = 3
+
+def shard_of(request_id, num_shards):
+    """
+    Stable shard assignment (Python's hash() is salted per process).
+    """
+    return zlib.crc32(str(request_id).encode("utf-8")) % num_shards
+
+def split_session(db, num_shards):
+    """
+    Session row indices for each shard.
+    """
+    shards = [[] for _ in range(num_shards)]
+    for index, row in enumerate(db):
+        shards[shard_of(row["request_id"], num_shards)].append(index)
+    return [shard for shard in shards if shard]
+
+def partial_aggregates(fragment):
+    """
+    Mergeable per-shard totals: row count, and PII and unsafe counts per agent.
+    """
+    return {
+        "rows": int(len(fragment["row_index"])),
+        "pii_count": {agent: int(fragment["pii_count"][:, a].sum()) for a, agent in enumerate(fragment["agents"])},
+        "unsafe": {agent: int(fragment["unsafe"][:, a].sum()) for a, agent in enumerate(fragment["agents"])}
+    }
+
+def merge_aggregates(aggregates):
+    """
+    Sum per-shard partial aggregates into session totals.
+    """
+    merged = {"rows": 0, "pii_count": {}, "unsafe": {}}
+    for partial in aggregates:
+        merged["rows"] += partial["rows"]
+        for key in ["pii_count", "unsafe"]:
+            for agent, count in partial[key].items():
+                merged[key][agent] = merged[key].get(agent, 0) + count
+    return merged
+
+def evaluate_shard(shard_rows, shard_indices, agents):
+    """
+    Worker entry point: score one shard and return its fragment and aggregates.
+    """
+    from pipeline.evaluate_session import evaluate_rows, SCORING_BATCH_SIZE
+
+    results = EvaluationResults(shard_rows, agents)
+    for start in range(0, len(shard_rows), SCORING_BATCH_SIZE):
+        evaluate_rows(shard_rows, range(start, min(len(shard_rows), start + SCORING_BATCH_SIZE)), results)
+
+    fragment = results.fragment(shard_indices)
+    return fragment, partial_aggregates(fragment)
+
+def run_shard(conn, shard_worker, shard_rows, shard_indices, agents, num_threads):
+    """
+    Body of one shard process: cap its threads, score the shard and send
+    ("ok", result) or ("error", message) back to the coordinator.
+
+    Shard processes always run the models in-process: the model server
+    handles one request at a time, so sharing it would serialize the shards.
+    """
+    from models import model_server, tuning
+    model_server.server_available = False
+    tuning.limit_threads(num_threads)
+    try:
+        conn.send(("ok", shard_worker(shard_rows, shard_indices, agents)))
+    except Exception as e:
+        conn.send(("error", repr(e)))
+    finally:
+        conn.close()
+
+def check_fragment(fragment, aggregates, shard_indices):
+    """
+    A shard result must cover exactly the rows it was assigned, and its
+    partial aggregates must match its result arrays.
+    """
+    if aggregates["rows"] != len(shard_indices):
+        return f"returned {aggregates['rows']} rows for {len(shard_indices)} assigned"
+    if not np.array_equal(np.sort(fragment["row_index"]), np.asarray(shard_indices)):
+        return "returned rows that do not match its assignment"
+    if aggregates != partial_aggregates(fragment):
+        return "reported aggregates that do not match its results"
+    return None
+
+def evaluate_sharded(db, num_workers, num_shards=None, max_attempts=MAX_SHARD_ATTEMPTS, shard_worker=evaluate_shard):
+    """
+    Score a session across num_workers processes and return an
+    EvaluationResults store in session row order.
+
+    Every shard attempt runs in its own process, so a crashing worker only
+    costs an attempt for its own shard. Each process loads its own models
+    (bypassing the model server) and gets an equal share of the host's cores.
+    """
+    ctx = multiprocessing.get_context()
+    agents = session_agents(db)
+    shards = split_session(db, num_shards or num_workers)
+    threads_per_worker = max(1, (os.cpu_count() or 1) // num_workers)
+    pending = deque(range(len(shards)))
+    attempts = [0] * len(shards)
+    running = {}  # result pipe -> (shard, process)
+    fragments = {}
+    aggregates = {}
+
+    try:
+        while pending or running:
+            # Keep num_workers shard processes busy
+            while pending and len(running) < num_workers:
+                shard = pending.popleft()
+                attempts[shard] += 1
+                indices = shards[shard]
+                reader, writer = ctx.Pipe(duplex=False)
+                process = ctx.Process(target=run_shard, args=(writer, shard_worker, [db[i] for i in indices],
+                                                              indices, agents, threads_per_worker))
+                process.start()
+                writer.close()  # A crashed worker then shows up as EOF
+                running[reader] = (shard, process)
+
+            for reader in wait(list(running)):
+                shard, process = running.pop(reader)
+                try:
+                    status, result = reader.recv()
+                except EOFError:
+                    status, result = "error", None
+                reader.close()
+                process.join()
+
+                if status == "ok":
+                    error = check_fragment(*result, shards[shard])
+                    if error is None:
+                        fragments[shard], aggregates[shard] = result
+                        print(f"Shard {shard + 1}/{len(shards)} done ({aggregates[shard]['rows']} rows)")
+                        continue
+                else:
+                    error = result or f"worker exited with code {process.exitcode}"
+
+                if attempts[shard] >= max_attempts:
+                    raise RuntimeError(f"Shard {shard + 1}/{len(shards)} failed after {attempts[shard]} attempts: {error}")
+                print(f"Shard {shard + 1}/{len(shards)} failed (attempt {attempts[shard]}), reassigning: {error}")
+                pending.append(shard)
+    finally:
+        for _, process in running.values():
+            process.terminate()
+
+    results = EvaluationResults.merge_fragments(db, [fragments[shard] for shard in range(len(shards))])
+    if not np.array_equal(results.row_index[:len(results)], np.arange(len(db))):
+        raise RuntimeError(f"Shard merge covers {len(results)} of {len(db)} rows")
+
+    # The shard-reported totals must agree with the merged arrays
+    totals = merge_aggregates(aggregates.values())
+    if totals != partial_aggregates(results.fragment()):
+        raise RuntimeError("Shard aggregates do not match the merged results")
+    print(f"Merged {totals['rows']} rows from {len(shards)} shards")
+    return results
@@ -1,206 +1,143 @@
-def generate_insights(evaluation_results):
-    def avg(scores):
-        return sum(scores) / len(scores) if scores else 0.0
-
-    # Determine if we're in single or dual agent mode
-    is_dual_agent = all("prodagent" in entry["evaluation"] and "shadagent" in entry["evaluation"] for entry in evaluation_results)
-    
-    # Initialize metrics containers based on mode
-    if is_dual_agent:
-        prod_logic = {"completeness": [], "relevance": [], "factuality": []}
-        shad_logic = {"completeness": [], "relevance": [], "factuality": []}
-        prod_llm = {"completeness": [], "relevance": [], "quality": []}
-        shad_llm = {"completeness": [], "relevance": [], "quality": []}
-        prod_pii = shad_pii = prod_unsafe = shad_unsafe = 0
-        prod_harmfulness_scores = []
-        shad_harmfulness_scores = []
-    else:
-        agent_logic = {"completeness": [], "relevance": [], "factuality": []}
-        agent_llm = {"completeness": [], "relevance": [], "quality": []}
-        agent_pii = agent_unsafe = 0
-        agent_harmfulness_scores = []
-    
-    # For temporal analysis
-    time_ordered_results = sorted(evaluation_results, key=lambda x: x.get("timestamp", 0))
-    session_data = {}
+import numpy as np
+from utils.result_store import EvaluationResults
 
-    for entry in evaluation_results:
-        # Handle dual agent case
-        if is_dual_agent:
-            prod = entry["evaluation"]["prodagent"]
-            shad = entry["evaluation"]["shadagent"]
-            
-            # Track session data
-            session_id = entry.get("session_id", "unknown")
-            if session_id not in session_data:
-                session_data[session_id] = {
-                    "prod_scores": [], 
-                    "shad_scores": [],
-                    "timestamps": []
-                }
-                
-            # Calculate overall score for this entry
-            prod_entry_score = (prod["logic"]["completeness"] + 
-                               prod["logic"]["relevance"] + 
-                               prod["logic"].get("factuality", 0)) / 3
-            shad_entry_score = (shad["logic"]["completeness"] + 
-                               shad["logic"]["relevance"] + 
-                               shad["logic"].get("factuality", 0)) / 3
-                               
-            # Add to session tracking
-            session_data[session_id]["prod_scores"].append(prod_entry_score)
-            session_data[session_id]["shad_scores"].append(shad_entry_score)
-            session_data[session_id]["timestamps"].append(entry.get("timestamp", 0))
-
-            # Logic
-            prod_logic["completeness"].append(prod["logic"]["completeness"])
-            prod_logic["relevance"].append(prod["logic"]["relevance"])
-            shad_logic["completeness"].append(shad["logic"]["completeness"])
-            shad_logic["relevance"].append(shad["logic"]["relevance"])
-            
-            # Add factuality if available
-            if "factuality" in prod["logic"]:
-                prod_logic["factuality"].append(prod["logic"]["factuality"])
-            if "factuality" in shad["logic"]:
-                shad_logic["factuality"].append(shad["logic"]["factuality"])
-
-            # LLM
-            for metric in ["completeness", "relevance", "quality"]:
-                prod_llm[metric].append(prod["llm"][metric])
-                shad_llm[metric].append(shad["llm"][metric])
-
-            # PII + Unsafe + Harmfulness
-            prod_pii += prod["pii_count"]
-            shad_pii += shad["pii_count"]
-            if prod["unsafe"]: prod_unsafe += 1
-            if shad["unsafe"]: shad_unsafe += 1
-            prod_harmfulness_scores.append(prod["harmfulness_score"])
-            shad_harmfulness_scores.append(shad["harmfulness_score"])
-        
-        # Handle single agent case
-        else:
-            agent = entry["evaluation"]["agent"]
-            
-            # Track session data
-            session_id = entry.get("session_id", "unknown")
-            if session_id not in session_data:
-                session_data[session_id] = {
-                    "agent_scores": [],
-                    "timestamps": []
-                }
-                
-            # Calculate overall score for this entry
-            agent_entry_score = (agent["logic"]["completeness"] + 
-                               agent["logic"]["relevance"] + 
-                               agent["logic"].get("factuality", 0)) / 3
-                               
-            # Add to session tracking
-            session_data[session_id]["agent_scores"].append(agent_entry_score)
-            session_data[session_id]["timestamps"].append(entry.get("timestamp", 0))
-
-            # Logic
-            agent_logic["completeness"].append(agent["logic"]["completeness"])
-            agent_logic["relevance"].append(agent["logic"]["relevance"])
-            
-            # Add factuality if available
-            if "factuality" in agent["logic"]:
-                agent_logic["factuality"].append(agent["logic"]["factuality"])
+# Bootstrap settings for sampled runs
+BOOTSTRAP_RESAMPLES = 1000
+CONFIDENCE_LEVEL = 0.95
 
-            # LLM
-            for metric in ["completeness", "relevance", "quality"]:
-                agent_llm[metric].append(agent["llm"][metric])
+def generate_insights(evaluation_results, bootstrap=False, population_size=None, strata=None):
+    """
+    Aggregate per-row evaluation results into session-level insights.
+    Accepts an EvaluationResults store or a list of evaluation_results dicts.
+    When bootstrap is True (sampled runs) the output also carries bootstrap
+    confidence intervals for every average and the prod-vs-shadow difference,
+    resampled within strata if given (one stratum label per session row).
+
+    When the results are a sample of population_size rows, the PII, unsafe
+    and LLM usage counts are scaled up to session estimates and the raw
+    counts are kept under sample_* keys.
+    """
+    def avg(scores):
+        return float(scores.mean()) if len(scores) else 0.0
 
-            # PII + Unsafe + Harmfulness
-            agent_pii += agent["pii_count"]
-            if agent["unsafe"]: agent_unsafe += 1
-            agent_harmfulness_scores.append(agent["harmfulness_score"])
+    if isinstance(evaluation_results, EvaluationResults):
+        results = evaluation_results
+    else:
+        results = EvaluationResults.from_entries(evaluation_results)
 
-    # Compute averages based on mode
-    if is_dual_agent:
-        avg_scores = {
-            "prodagent": {
-                "logic": {k: round(avg(v), 4) for k, v in prod_logic.items()},
-                "llm": {k: round(avg(v), 4) for k, v in prod_llm.items()},
-                "avg_harmfulness_score": round(avg(prod_harmfulness_scores), 6)
-            },
-            "shadagent": {
-                "logic": {k: round(avg(v), 4) for k, v in shad_logic.items()},
-                "llm": {k: round(avg(v), 4) for k, v in shad_llm.items()},
-                "avg_harmfulness_score": round(avg(shad_harmfulness_scores), 6)
-            }
+    # Determine if we're in single or dual agent mode
+    is_dual_agent = results.is_dual_agent
+    n = len(results)
+
+    avg_scores = {}
+    pii_violations = {}
+    unsafe_responses = {}
+    llm_usage = {}
+    overall_scores = {}
+    entry_scores = {}
+
+    for a, agent in enumerate(results.agents):
+        avg_scores[agent] = {
+            "logic": {m: round(avg(results.column(agent, f"logic.{m}")), 4) for m in ["completeness", "relevance", "factuality"]},
+            "llm": {m: round(avg(results.column(agent, f"llm.{m}")), 4) for m in ["completeness", "relevance", "quality"]},
+            "avg_harmfulness_score": round(avg(results.column(agent, "harmfulness_score")), 6)
+        }
+        pii_violations[agent] = int(results.pii_count[:n, a].sum())
+        unsafe_responses[agent] = int(results.unsafe[:n, a].sum())
+        llm_usage[agent] = {
+            "input_tokens": int(results.llm_tokens[:n, a, 0].sum()),
+            "output_tokens": int(results.llm_tokens[:n, a, 1].sum()),
+            "estimated_cost": round(float(results.llm_cost[:n, a].sum()), 6)
         }
 
-        # Compute overall scores (now including factuality if available)
-        factuality_weight = 1 if prod_logic.get("factuality") else 0
-        prod_score = round(
-            avg_scores["prodagent"]["logic"]["completeness"] + 
-            avg_scores["prodagent"]["logic"]["relevance"] + 
-            (avg_scores["prodagent"]["logic"].get("factuality", 0) * factuality_weight), 
-            4
-        )
-        shad_score = round(
-            avg_scores["shadagent"]["logic"]["completeness"] + 
-            avg_scores["shadagent"]["logic"]["relevance"] + 
-            (avg_scores["shadagent"]["logic"].get("factuality", 0) * factuality_weight), 
-            4
-        )
-        
-        # Generate insights text for dual agent
-        insights_text = generate_dual_agent_insights(avg_scores, prod_score, shad_score, prod_pii, shad_pii, prod_unsafe, shad_unsafe)
-    else:
-        avg_scores = {
-            "agent": {
-                "logic": {k: round(avg(v), 4) for k, v in agent_logic.items()},
-                "llm": {k: round(avg(v), 4) for k, v in agent_llm.items()},
-                "avg_harmfulness_score": round(avg(agent_harmfulness_scores), 6)
+        # Overall score (including factuality)
+        logic = avg_scores[agent]["logic"]
+        overall_scores[agent] = round(logic["completeness"] + logic["relevance"] + logic["factuality"], 4)
+
+        # Per-entry score: average of the logic metrics
+        entry_scores[agent] = (results.logic_total(agent) / 3).tolist()
+
+    # Counts of a sampled run only cover the sample: estimate session totals
+    sample_counts = None
+    pii_text, unsafe_text = pii_violations, unsafe_responses
+    if population_size and n and population_size > n:
+        scale = population_size / n
+        sample_counts = {
+            "sample_pii_violations": pii_violations,
+            "sample_unsafe_responses": unsafe_responses,
+            "sample_llm_usage": {
+                **llm_usage,
+                "total_estimated_cost": round(sum(usage["estimated_cost"] for usage in llm_usage.values()), 6)
             }
         }
+        pii_violations = {agent: round(count * scale) for agent, count in pii_violations.items()}
+        unsafe_responses = {agent: round(count * scale) for agent, count in unsafe_responses.items()}
+        llm_usage = {agent: {
+            "input_tokens": round(usage["input_tokens"] * scale),
+            "output_tokens": round(usage["output_tokens"] * scale),
+            "estimated_cost": round(usage["estimated_cost"] * scale, 6)
+        } for agent, usage in llm_usage.items()}
+
+        def estimated(counts, sampled):
+            return {agent: f"~{counts[agent]} (estimated from {sampled[agent]} in {n} sampled rows)" for agent in counts}
+        pii_text = estimated(pii_violations, sample_counts["sample_pii_violations"])
+        unsafe_text = estimated(unsafe_responses, sample_counts["sample_unsafe_responses"])
+
+    # Generate insights text based on mode
+    if is_dual_agent:
+        insights_text = generate_dual_agent_insights(avg_scores, overall_scores["prodagent"], overall_scores["shadagent"],
+                                                     pii_text["prodagent"], pii_text["shadagent"],
+                                                     unsafe_text["prodagent"], unsafe_text["shadagent"])
+    else:
+        insights_text = generate_single_agent_insights(avg_scores, overall_scores["agent"],
+                                                       pii_text["agent"], unsafe_text["agent"])
+
+    # For temporal analysis
+    timestamps = [t or 0 for t in results.row_field("unix_timestamp", 0)]
+    time_order = sorted(range(n), key=lambda i: timestamps[i])
+    time_ordered_scores = {agent: [scores[i] for i in time_order] for agent, scores in entry_scores.items()}
+
+    # Track per-session scores
+    session_data = {}
+    for i, session_id in enumerate(results.row_field("session_id")):
+        if session_id not in session_data:
+            session_data[session_id] = {f"{agent_prefix(agent)}_scores": [] for agent in results.agents}
+            session_data[session_id]["timestamps"] = []
+        for agent in results.agents:
+            session_data[session_id][f"{agent_prefix(agent)}_scores"].append(entry_scores[agent][i])
+        session_data[session_id]["timestamps"].append(timestamps[i])
 
-        # Compute overall score (including factuality if available)
-        factuality_weight = 1 if agent_logic.get("factuality") else 0
-        agent_score = round(
-            avg_scores["agent"]["logic"]["completeness"] + 
-            avg_scores["agent"]["logic"]["relevance"] + 
-            (avg_scores["agent"]["logic"].get("factuality", 0) * factuality_weight), 
-            4
-        )
-        
-        # Generate insights text for single agent
-        insights_text = generate_single_agent_insights(avg_scores, agent_score, agent_pii, agent_unsafe)
-    
     # Analyze temporal trends
-    temporal_insights = analyze_temporal_trends(time_ordered_results, is_dual_agent)
+    temporal_insights = analyze_temporal_trends(time_ordered_scores, is_dual_agent)
     session_insights = analyze_session_performance(session_data, is_dual_agent)
 
-    # Return results based on mode
-    if is_dual_agent:
-        return {
-            "average_scores": avg_scores,
-            "pii_violations": {
-                "prodagent": prod_pii,
-                "shadagent": shad_pii
-            },
-            "unsafe_responses": {
-                "prodagent": prod_unsafe,
-                "shadagent": shad_unsafe
-            },
-            "temporal_analysis": temporal_insights,
-            "session_analysis": session_insights,
-            "summary": insights_text.strip()
-        }
-    else:
-        return {
-            "average_scores": avg_scores,
-            "pii_violations": {
-                "agent": agent_pii
-            },
-            "unsafe_responses": {
-                "agent": agent_unsafe
-            },
-            "temporal_analysis": temporal_insights,
-            "session_analysis": session_insights,
-            "summary": insights_text.strip()
-        }
+    insights = {
+        "average_scores": avg_scores,
+        "pii_violations": pii_violations,
+        "unsafe_responses": unsafe_responses,
+        "llm_usage": {
+            **llm_usage,
+            "total_estimated_cost": round(sum(usage["estimated_cost"] for usage in llm_usage.values()), 6)
+        },
+        "temporal_analysis": temporal_insights,
+        "session_analysis": session_insights,
+        "summary": insights_text.strip()
+    }
+    if sample_counts:
+        insights.update(sample_counts)
+
+    if bootstrap:
+        intervals = bootstrap_confidence_intervals(results, strata=strata)
+        insights["confidence_intervals"] = intervals
+        insights["summary"] += "\n\n" + generate_confidence_insights(intervals, is_dual_agent)
+
+    return insights
+
+def agent_prefix(agent):
+    """
+    Short name used for an agent in session tracking keys.
+    """
+    return {"prodagent": "prod", "shadagent": "shad"}.get(agent, agent)
 
 # Add new helper functions for generating insights text
 def generate_dual_agent_insights(avg_scores, prod_score, shad_score, prod_pii, shad_pii, prod_unsafe, shad_unsafe):
@@ -290,50 +227,22 @@ def generate_single_agent_insights(avg_scores, agent_score, agent_pii, agent_uns
 
     return insights_text
 
-def analyze_temporal_trends(time_ordered_results, is_dual_agent=True):
+def analyze_temporal_trends(time_ordered_scores, is_dual_agent=True):
     """
     Analyze how agent performance changes over time within the dataset.
+    time_ordered_scores maps each agent to its per-entry scores in time order.
     """
-    if not time_ordered_results or len(time_ordered_results) < 2:
-        return "Insufficient data for temporal analysis."
-        
-    # Initialize tracking variables
     if is_dual_agent:
-        prod_scores = []
-        shad_scores = []
+        prod_scores = time_ordered_scores["prodagent"]
+        shad_scores = time_ordered_scores["shadagent"]
+        entry_count = len(prod_scores)
     else:
-        agent_scores = []
-    timestamps = []
-    
-    # Extract scores over time
-    for entry in time_ordered_results:
-        if is_dual_agent:
-            prod = entry["evaluation"]["prodagent"]
-            shad = entry["evaluation"]["shadagent"]
-            
-            # Calculate overall score for this entry (average of logic metrics)
-            prod_logic = prod["logic"]
-            shad_logic = shad["logic"]
-            
-            metrics_count = len(prod_logic)
-            prod_entry_score = sum(prod_logic.values()) / metrics_count
-            shad_entry_score = sum(shad_logic.values()) / metrics_count
-            
-            prod_scores.append(prod_entry_score)
-            shad_scores.append(shad_entry_score)
-        else:
-            agent = entry["evaluation"]["agent"]
-            
-            # Calculate overall score for this entry (average of logic metrics)
-            agent_logic = agent["logic"]
-            
-            metrics_count = len(agent_logic)
-            agent_entry_score = sum(agent_logic.values()) / metrics_count
-            
-            agent_scores.append(agent_entry_score)
-            
-        timestamps.append(entry.get("readable_timestamp", "Unknown"))
-    
+        agent_scores = time_ordered_scores["agent"]
+        entry_count = len(agent_scores)
+
+    if entry_count < 2:
+        return "Insufficient data for temporal analysis."
+
     # Analyze for trends
     if is_dual_agent:
         prod_trend = "improving" if prod_scores[-1] > prod_scores[0] else "declining"
@@ -451,3 +360,106 @@ def calculate_consistency(scores):
     consistency = max(0, 1 - min(variance * 5, 1))  # Scale factor of 5 to make differences more apparent
     
     return consistency
+
+def bootstrap_confidence_intervals(results, n_resamples=BOOTSTRAP_RESAMPLES,
+                                   confidence=CONFIDENCE_LEVEL, seed=0, strata=None):
+    """
+    Paired bootstrap confidence intervals for every average score, each agent's
+    overall score and (in dual agent mode) the shadow-minus-production difference.
+    All metrics share the same resampled rows so the intervals stay comparable.
+
+    strata holds one stratum label per session row. When given, rows are
+    resampled within their stratum, matching a proportionally allocated
+    stratified sample. Without it rows are resampled freely, which gives
+    conservative (wider) intervals for a stratified sample.
+    """
+    n = len(results)
+    if n < 2:
+        return {}
+
+    # One row of per-entry values per reported metric
+    keys = []
+    columns = []
+    for agent in results.agents:
+        for metric in ["completeness", "relevance", "factuality"]:
+            keys.append((agent, "logic", metric))
+            columns.append(results.column(agent, f"logic.{metric}"))
+        for metric in ["completeness", "relevance", "quality"]:
+            keys.append((agent, "llm", metric))
+            columns.append(results.column(agent, f"llm.{metric}"))
+        keys.append((agent, "avg_harmfulness_score"))
+        columns.append(results.column(agent, "harmfulness_score"))
+        keys.append((agent, "overall_score"))
+        columns.append(results.logic_total(agent))
+    if results.is_dual_agent:
+        keys.append(("overall_difference",))
+        columns.append(results.logic_total("shadagent") - results.logic_total("prodagent"))
+
+    values = np.asarray(columns, dtype=np.float64)
+    if strata is None:
+        groups = [np.arange(n)]
+    else:
+        by_stratum = {}
+        for position, row in enumerate(results.row_index[:n]):
+            by_stratum.setdefault(strata[row], []).append(position)
+        groups = [np.asarray(positions) for positions in by_stratum.values()]
+
+    rng = np.random.default_rng(seed)
+    means = np.empty((n_resamples, len(keys)))
+    for b in range(n_resamples):
+        resample = np.concatenate([group[rng.integers(0, len(group), size=len(group))] for group in groups])
+        means[b] = values[:, resample].mean(axis=1)
+
+    alpha = (1 - confidence) / 2 * 100
+    lows, highs = np.percentile(means, [alpha, 100 - alpha], axis=0)
+
+    intervals = {"confidence": confidence, "n_resamples": n_resamples, "sample_size": n}
+    for key, low, high in zip(keys, lows, highs):
+        node = intervals
+        for part in key[:-1]:
+            node = node.setdefault(part, {})
+        node[key[-1]] = [round(float(low), 4), round(float(high), 4)]
+
+    return intervals
+
+def generate_confidence_insights(intervals, is_dual_agent=True):
+    """
+    Summarize the overall-score intervals of a sampled run.
+    """
+    if not intervals:
+        return "# Confidence Intervals\n- Insufficient sample for bootstrap intervals."
+
+    level = int(intervals["confidence"] * 100)
+    lines = [f"# Confidence Intervals ({level}%, n={intervals['sample_size']})"]
+    if is_dual_agent:
+        prod_low, prod_high = intervals["prodagent"]["overall_score"]
+        shad_low, shad_high = intervals["shadagent"]["overall_score"]
+        diff_low, diff_high = intervals["overall_difference"]
+        lines.append(f"- Production Agent Overall Score: [{prod_low}, {prod_high}]")
+        lines.append(f"- Shadow Agent Overall Score: [{shad_low}, {shad_high}]")
+        lines.append(f"- Shadow minus Production: [{diff_low}, {diff_high}]")
+        if diff_low > 0:
+            lines.append("- Shadow Agent is better with statistical confidence.")
+        elif diff_high < 0:
+            lines.append("- Production Agent is better with statistical confidence.")
+        else:
+            lines.append("- The difference between the agents is not significant at this sample size.")
+    else:
+        agent_low, agent_high = intervals["agent"]["overall_score"]
+        lines.append(f"- Agent Overall Score: [{agent_low}, {agent_high}]")
+
+    return "\n".join(lines)
+
+def max_interval_half_width(intervals, is_dual_agent=True):
+    """
+    Largest half-width among the overall-score (and difference) intervals,
+    used to decide when a sampled run is precise enough to stop.
+    """
+    if not intervals:
+        return float("inf")
+
+    if is_dual_agent:
+        bounds = [intervals["prodagent"]["overall_score"], intervals["shadagent"]["overall_score"], intervals["overall_difference"]]
+    else:
+        bounds = [intervals["agent"]["overall_score"]]
+    return max((high - low) / 2 for low, high in bounds)
@@ -0,0 +1,257 @@
+import json
+import numpy as np
+
+DUAL_AGENTS = ("prodagent", "shadagent")
+SINGLE_AGENTS = ("agent",)
+
+# Score columns stored per (row, agent), in serialization order
+LOGIC_METRICS = ("completeness", "relevance", "factuality")
+LLM_METRICS = ("relevance", "completeness", "quality")
+SCORE_FIELDS = tuple(f"logic.{m}" for m in LOGIC_METRICS) + tuple(f"llm.{m}" for m in LLM_METRICS) + ("harmfulness_score",)
+FIELD_INDEX = {field: i for i, field in enumerate(SCORE_FIELDS)}
+
+# Session row keys holding each agent's response, and their output names
+RESPONSE_KEYS = {
+    "prodagent": ("prodagent_response", "prod_response"),
+    "shadagent": ("shadagent_response", "shad_response"),
+    "agent": ("agent_response", "agent_response"),
+}
+
+def session_agents(rows):
+    """
+    Agents evaluated for a session: dual mode only if every row has both responses.
+    """
+    is_dual_agent = all("prodagent_response" in row and "shadagent_response" in row for row in rows)
+    return DUAL_AGENTS if is_dual_agent else SINGLE_AGENTS
+
+class EvaluationResults:
+    """
+    Array-backed evaluation results for one session.
+
+    Scores live in a preallocated float32 array indexed by
+    (result, agent, field); safety flags, PII counts and LLM judge token
+    usage in parallel arrays.
+    Query/response texts are not copied, each result only stores the index
+    of its session row. Use to_json() for the evaluation_results schema.
+
+    Scores are kept in float32 (about 7 significant digits), so stored and
+    serialized scores can differ from the float64 values the metrics
+    computed from the 7th decimal on. LLM judge costs stay float64.
+    """
+    __slots__ = ("rows", "agents", "size", "row_index", "scores", "unsafe", "pii_count", "llm_tokens", "llm_cost")
+
+    def __init__(self, rows, agents=None, capacity=None):
+        self.rows = rows
+        self.agents = tuple(agents or session_agents(rows))
+        capacity = len(rows) if capacity is None else capacity
+        self.size = 0
+        self.row_index = np.zeros(capacity, dtype=np.int64)
+        self.scores = np.zeros((capacity, len(self.agents), len(SCORE_FIELDS)), dtype=np.float32)
+        self.unsafe = np.zeros((capacity, len(self.agents)), dtype=bool)
+        self.pii_count = np.zeros((capacity, len(self.agents)), dtype=np.int32)
+        self.llm_tokens = np.zeros((capacity, len(self.agents), 2), dtype=np.int32)  # (input, output)
+        self.llm_cost = np.zeros((capacity, len(self.agents)), dtype=np.float64)
+
+    @property
+    def is_dual_agent(self):
+        return self.agents == DUAL_AGENTS
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, i):
+        if not -self.size <= i < self.size:
+            raise IndexError("result index out of range")
+        return ResultRow(self, i % self.size)
+
+    def __iter__(self):
+        return (ResultRow(self, i) for i in range(self.size))
+
+    def append(self, row_index, evaluation):
+        """
+        Store the evaluation of session row row_index.
+        evaluation maps each agent to its logic/llm/harmfulness/unsafe/pii_count
+        scores and optional llm_usage.
+        """
+        i = self.size
+        if i == len(self.row_index):
+            raise IndexError("EvaluationResults is full")
+
+        self.row_index[i] = row_index
+        for a, agent in enumerate(self.agents):
+            scores = evaluation[agent]
+            for m in LOGIC_METRICS:
+                self.scores[i, a, FIELD_INDEX[f"logic.{m}"]] = scores["logic"].get(m, 0.0)
+            for m in LLM_METRICS:
+                self.scores[i, a, FIELD_INDEX[f"llm.{m}"]] = scores["llm"].get(m, 0.0)
+            self.scores[i, a, FIELD_INDEX["harmfulness_score"]] = scores["harmfulness_score"]
+            self.unsafe[i, a] = scores["unsafe"]
+            self.pii_count[i, a] = scores["pii_count"]
+            usage = scores.get("llm_usage") or {}
+            self.llm_tokens[i, a] = (usage.get("input_tokens", 0), usage.get("output_tokens", 0))
+            self.llm_cost[i, a] = usage.get("estimated_cost", 0.0)
+        self.size += 1
+
+    def column(self, agent, field):
+        """
+        float64 view-copy of one score field for one agent across all results.
+        """
+        return self.scores[:self.size, self.agents.index(agent), FIELD_INDEX[field]].astype(np.float64)
+
+    def logic_total(self, agent):
+        """
+        Per-result sum of the logic metrics for one agent.
+        """
+        a = self.agents.index(agent)
+        columns = [FIELD_INDEX[f"logic.{m}"] for m in LOGIC_METRICS]
+        return self.scores[:self.size, a][:, columns].astype(np.float64).sum(axis=1)
+
+    def row_field(self, key, default=None):
+        """
+        One session row field for every stored result, in result order.
+        """
+        return [self.rows[r].get(key, default) for r in self.row_index[:self.size]]
+
+    def fragment(self, row_indices=None):
+        """
+        Compact, picklable copy of the stored arrays (e.g. one shard's results).
+        row_indices maps stored row positions to session row indices.
+        """
+        n = self.size
+        index = self.row_index[:n] if row_indices is None else np.asarray(row_indices)[self.row_index[:n]]
+        return {
+            "agents": self.agents,
+            "row_index": index.copy(),
+            "scores": self.scores[:n].copy(),
+            "unsafe": self.unsafe[:n].copy(),
+            "pii_count": self.pii_count[:n].copy(),
+            "llm_tokens": self.llm_tokens[:n].copy(),
+            "llm_cost": self.llm_cost[:n].copy()
+        }
+
+    @classmethod
+    def merge_fragments(cls, rows, fragments):
+        """
+        Combine fragments of one session into a store ordered by session row.
+        """
+        agents = fragments[0]["agents"] if fragments else None
+        row_index = np.concatenate([f["row_index"] for f in fragments]) if fragments else np.zeros(0, dtype=np.int64)
+        order = np.argsort(row_index, kind="stable")
+
+        store = cls(rows, agents, capacity=len(row_index))
+        store.size = len(row_index)
+        if fragments:
+            store.row_index[:] = row_index[order]
+            store.scores[:] = np.concatenate([f["scores"] for f in fragments])[order]
+            store.unsafe[:] = np.concatenate([f["unsafe"] for f in fragments])[order]
+            store.pii_count[:] = np.concatenate([f["pii_count"] for f in fragments])[order]
+            store.llm_tokens[:] = np.concatenate([f["llm_tokens"] for f in fragments])[order]
+            store.llm_cost[:] = np.concatenate([f["llm_cost"] for f in fragments])[order]
+        return store
+
+    def to_json(self):
+        """
+        Serialize to the evaluation_results list schema. Scores are the
+        stored float32 values rounded to 6 decimals, so this is lossy and
+        from_entries(to_json()) is not bit-identical to the original scores.
+        Builds every entry dict at once; use iter_json() to write output.
+        """
+        return [row.to_dict() for row in self]
+
+    def iter_json(self, indent=2, level=0):
+        """
+        Encode to_json() as JSON text one entry at a time, so only one entry
+        dict exists at once. The chunks join to json.dumps(self.to_json(),
+        indent=indent) nested level levels deep.
+        """
+        if not self.size:
+            yield "[]"
+            return
+        pad = "\n" + " " * (indent * (level + 1))
+        yield "["
+        for i, row in enumerate(self):
+            yield ("," if i else "") + pad + json.dumps(row.to_dict(), indent=indent).replace("\n", pad)
+        yield "\n" + " " * (indent * level) + "]"
+
+    @classmethod
+    def from_entries(cls, entries):
+        """
+        Build a store from evaluation_results dicts (e.g. a loaded JSON file).
+        """
+        rows = []
+        for entry in entries:
+            row = {
+                "request_id": entry.get("request_id"),
+                "session_id": entry.get("session_id"),
+                "unix_timestamp": entry.get("timestamp"),
+                "readable_timestamp": entry.get("readable_timestamp"),
+                "request": entry.get("query"),
+            }
+            for agent, (row_key, entry_key) in RESPONSE_KEYS.items():
+                if agent in entry["evaluation"]:
+                    row[row_key] = entry.get(entry_key)
+            rows.append(row)
+
+        is_dual_agent = all(all(a in entry["evaluation"] for a in DUAL_AGENTS) for entry in entries)
+        store = cls(rows, DUAL_AGENTS if is_dual_agent else SINGLE_AGENTS)
+        for i, entry in enumerate(entries):
+            store.append(i, entry["evaluation"])
+        return store
+
+class ResultRow:
+    """
+    Lightweight view of one stored result.
+    """
+    __slots__ = ("store", "index")
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    @property
+    def row(self):
+        return self.store.rows[self.store.row_index[self.index]]
+
+    def score(self, agent, field):
+        return float(self.store.scores[self.index, self.store.agents.index(agent), FIELD_INDEX[field]])
+
+    def agent_evaluation(self, agent):
+        """
+        Evaluation dict for one agent; scores are rounded to 6 decimals,
+        the precision float32 storage keeps for values in [0, 1].
+        """
+        a = self.store.agents.index(agent)
+        scores = self.store.scores[self.index, a]
+        return {
+            "logic": {m: round(float(scores[FIELD_INDEX[f"logic.{m}"]]), 6) for m in LOGIC_METRICS},
+            "llm": {m: round(float(scores[FIELD_INDEX[f"llm.{m}"]]), 6) for m in LLM_METRICS},
+            "harmfulness_score": round(float(scores[FIELD_INDEX["harmfulness_score"]]), 6),
+            "unsafe": bool(self.store.unsafe[self.index, a]),
+            "pii_count": int(self.store.pii_count[self.index, a]),
+            "llm_usage": {
+                "input_tokens": int(self.store.llm_tokens[self.index, a, 0]),
+                "output_tokens": int(self.store.llm_tokens[self.index, a, 1]),
+                "estimated_cost": float(self.store.llm_cost[self.index, a])
+            }
+        }
+
+    def to_dict(self):
+        row = self.row
+        entry = {
+            "request_id": row["request_id"],
+            "session_id": row.get("session_id"),
+            "timestamp": row.get("unix_timestamp"),
+            "readable_timestamp": row.get("readable_timestamp"),
+            "query": row["request"],
+        }
+        for agent in self.store.agents:
+            row_key, entry_key = RESPONSE_KEYS[agent]
+            entry[entry_key] = row[row_key]
+        entry["evaluation"] = {agent: self.agent_evaluation(agent) for agent in self.store.agents}
+        return entry
+
+    def __getitem__(self, key):
+        return self.to_dict()[key]
+
+    def get(self, key, default=None):
+        return self.to_dict().get(key, default)
@@ -1,6 +1,7 @@
-import boto3, json
+import boto3, json, tempfile
 
 S3_KEY_PREFIX = "interactions/"
+SPOOL_MAX_SIZE = 16 * 1024 * 1024  # Larger uploads are buffered on disk
 session = boto3.Session(profile_name="hari-work")
 s3_client = session.client("s3")
 
@@ -24,3 +25,18 @@ def save_evaluation_results(session_id, data, bucket_name):
         )
     except Exception as e:
         print(f"Error saving results: {e}")
+
+def save_evaluation_stream(session_id, chunks, bucket_name):
+    """
+    Upload evaluation results given as an iterable of JSON text chunks,
+    without building the whole document in memory.
+    """
+    s3_key = f"{S3_KEY_PREFIX}{session_id}/evaluation_results.json"
+    try:
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as body:
+            for chunk in chunks:
+                body.write(chunk.encode("utf-8"))
+            body.seek(0)
+            s3_client.upload_fileobj(body, bucket_name, s3_key, ExtraArgs={"ContentType": "application/json"})
+    except Exception as e:
+        print(f"Error saving results: {e}")
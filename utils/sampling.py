@@ -0,0 +1,59 @@
+import random
+from metrics.text_features import has_knowledge_indicator
+
+# Stratification settings
+TIME_BUCKETS = 10
+LENGTH_BANDS = (20, 100)  # Word-count band edges for the response
+
+def response_length_band(response, bands=LENGTH_BANDS):
+    """
+    Map a response to its word-count band (0 = shortest).
+    """
+    words = len(response.split())
+    for band, edge in enumerate(bands):
+        if words < edge:
+            return band
+    return len(bands)
+
+def stratum_key(row, t_min, t_span, time_buckets=TIME_BUCKETS):
+    """
+    Build the (time bucket, query type, response length band) stratum for a row.
+    The length band is taken from the production response in dual agent mode.
+    """
+    timestamp = row.get("unix_timestamp") or t_min
+    time_bucket = min(time_buckets - 1, int((timestamp - t_min) / t_span * time_buckets)) if t_span else 0
+    response = row.get("prodagent_response", row.get("agent_response", ""))
+    return (time_bucket, has_knowledge_indicator(row["request"]), response_length_band(response))
+
+def row_strata(db, time_buckets=TIME_BUCKETS):
+    """
+    Stratum key of every session row, in row order.
+    """
+    timestamps = [row.get("unix_timestamp") for row in db if row.get("unix_timestamp") is not None]
+    t_min = min(timestamps) if timestamps else 0
+    t_span = (max(timestamps) - t_min) if timestamps else 0
+    return [stratum_key(row, t_min, t_span, time_buckets) for row in db]
+
+def stratified_order(db, seed=0, time_buckets=TIME_BUCKETS):
+    """
+    Order session row indices so that every prefix is a proportionally
+    allocated stratified sample.
+
+    Each stratum is shuffled and its i-th row is placed at position
+    (i + u) / stratum_size with a random offset u, so strata interleave in
+    proportion to their size. Scoring the first n rows of the result is a
+    stratified sample of size n.
+    """
+    rng = random.Random(seed)
+    strata = {}
+    for index, key in enumerate(row_strata(db, time_buckets)):
+        strata.setdefault(key, []).append(index)
+
+    keyed = []
+    for indices in strata.values():
+        rng.shuffle(indices)
+        offset = rng.random()
+        keyed.extend(((i + offset) / len(indices), index) for i, index in enumerate(indices))
+
+    keyed.sort(key=lambda item: item[0])
+    return [index for _, index in keyed], len(strata)
@@ -0,0 +1,346 @@
+"""
+Local append-only store of per-row scores across sessions.
+
+Every run appends its per-row scores to a SQLite database. Daily
+aggregates and per-agent drift state (EWMA and CUSUM on the overall score)
+are updated incrementally on append, from full runs only: rows of sampled
+runs are kept in the scores table but flagged, since they are not
+representative of their sessions. Rolling averages, drift status and
+prod-vs-shadow deltas across weeks of sessions can be queried without
+re-reading old evaluation results from S3.
+"""
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+
+HISTORY_PATH = os.environ.get(
+    "HYBRID_EVAL_HISTORY_DB",
+    os.path.join(os.path.expanduser("~"), ".cache", "hybrid-eval", "score_history.sqlite")
+)
+
+METRIC_COLUMNS = {
+    "completeness": "logic.completeness",
+    "relevance": "logic.relevance",
+    "factuality": "logic.factuality",
+    "llm_relevance": "llm.relevance",
+    "llm_completeness": "llm.completeness",
+    "llm_quality": "llm.quality",
+    "harmfulness": "harmfulness_score",
+}
+
+# Drift detection settings (on the per-row overall score)
+DRIFT_WARMUP = 100       # Rows used to estimate the reference mean and std
+EWMA_LAMBDA = 0.05
+EWMA_LIMIT = 3.0         # Control limit in std units of the EWMA statistic
+CUSUM_K = 0.5            # Allowance in std units
+CUSUM_H = 5.0            # Decision threshold in std units
+DRIFT_ALARM_HOLD = 100   # Rows an alarm stays reported after CUSUM is reset
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS scores (
+    session_id TEXT,
+    request_id TEXT,
+    agent TEXT,
+    ts INTEGER,
+    day TEXT,
+    {", ".join(f"{name} REAL" for name in METRIC_COLUMNS)},
+    overall REAL,
+    unsafe INTEGER,
+    pii_count INTEGER,
+    sampled INTEGER,
+    PRIMARY KEY (session_id, request_id, agent)
+);
+CREATE INDEX IF NOT EXISTS scores_agent_ts ON scores (agent, ts);
+CREATE INDEX IF NOT EXISTS scores_day ON scores (day);
+
+CREATE TABLE IF NOT EXISTS daily_aggregates (
+    day TEXT,
+    agent TEXT,
+    n INTEGER,
+    {", ".join(f"sum_{name} REAL" for name in METRIC_COLUMNS)},
+    sum_overall REAL,
+    sum_overall_sq REAL,
+    unsafe INTEGER,
+    pii_count INTEGER,
+    PRIMARY KEY (day, agent)
+);
+
+CREATE TABLE IF NOT EXISTS drift_state (
+    agent TEXT PRIMARY KEY,
+    n INTEGER,
+    mean REAL,
+    m2 REAL,
+    reference_mean REAL,
+    reference_std REAL,
+    ewma REAL,
+    cusum_pos REAL,
+    cusum_neg REAL,
+    last_ts INTEGER,
+    alarms INTEGER,
+    last_alarm TEXT,
+    last_alarm_n INTEGER,
+    last_alarm_ts INTEGER
+);
+"""
+
+def connect(path=HISTORY_PATH):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    return conn
+
+def day_of(ts):
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime("%Y-%m-%d")
+
+def record_results(results, sampled=False, path=HISTORY_PATH):
+    """
+    Append the per-row scores of an EvaluationResults store and update the
+    daily aggregates and drift state. Rows already recorded are skipped,
+    except that a full run replaces rows recorded by a sampled run.
+    Sampled runs (sampled=True) only append to the scores table.
+    Returns the number of new rows.
+    """
+    n = len(results)
+    now = int(time.time())
+    session_ids = results.row_field("session_id")
+    request_ids = results.row_field("request_id")
+    timestamps = [ts if ts is not None else now for ts in results.row_field("unix_timestamp")]
+    days = [day_of(ts) for ts in timestamps]
+
+    conn = connect(path)
+    inserted = 0
+    try:
+        with conn:
+            for a, agent in enumerate(results.agents):
+                columns = {name: results.column(agent, field).tolist() for name, field in METRIC_COLUMNS.items()}
+                overall = results.logic_total(agent).tolist()
+                unsafe = results.unsafe[:n, a].tolist()
+                pii_count = results.pii_count[:n, a].tolist()
+
+                new_rows = []
+                for i in range(n):
+                    cursor = conn.execute(
+                        f"""INSERT INTO scores VALUES ({", ".join("?" * (len(METRIC_COLUMNS) + 9))})
+                            ON CONFLICT (session_id, request_id, agent) DO UPDATE SET
+                                {", ".join(f"{c} = excluded.{c}" for c in [*METRIC_COLUMNS, "overall", "unsafe", "pii_count", "sampled"])}
+                            WHERE scores.sampled AND NOT excluded.sampled""",
+                        (session_ids[i] or "unknown", request_ids[i], agent, timestamps[i], days[i],
+                         *(columns[name][i] for name in METRIC_COLUMNS), overall[i],
+                         int(unsafe[i]), pii_count[i], int(sampled))
+                    )
+                    if cursor.rowcount:
+                        new_rows.append(i)
+
+                if not sampled:
+                    update_daily_aggregates(conn, agent, new_rows, days, columns, overall, unsafe, pii_count)
+                    update_drift_state(conn, agent, sorted(new_rows, key=lambda i: timestamps[i]), overall, timestamps)
+                inserted += len(new_rows)
+    finally:
+        conn.close()
+    return inserted
+
+def update_daily_aggregates(conn, agent, new_rows, days, columns, overall, unsafe, pii_count):
+    totals = {}
+    for i in new_rows:
+        t = totals.setdefault(days[i], {"n": 0, "overall": 0.0, "overall_sq": 0.0, "unsafe": 0, "pii_count": 0,
+                                        **{name: 0.0 for name in METRIC_COLUMNS}})
+        t["n"] += 1
+        for name in METRIC_COLUMNS:
+            t[name] += columns[name][i]
+        t["overall"] += overall[i]
+        t["overall_sq"] += overall[i] ** 2
+        t["unsafe"] += int(unsafe[i])
+        t["pii_count"] += pii_count[i]
+
+    sum_columns = [f"sum_{name}" for name in METRIC_COLUMNS] + ["sum_overall", "sum_overall_sq"]
+    for day, t in totals.items():
+        values = [t[name] for name in METRIC_COLUMNS] + [t["overall"], t["overall_sq"]]
+        conn.execute(
+            f"""INSERT INTO daily_aggregates (day, agent, n, {", ".join(sum_columns)}, unsafe, pii_count)
+                VALUES (?, ?, ?, {", ".join("?" * len(sum_columns))}, ?, ?)
+                ON CONFLICT (day, agent) DO UPDATE SET
+                    n = n + excluded.n,
+                    {", ".join(f"{c} = {c} + excluded.{c}" for c in sum_columns)},
+                    unsafe = unsafe + excluded.unsafe,
+                    pii_count = pii_count + excluded.pii_count""",
+            (day, agent, t["n"], *values, t["unsafe"], t["pii_count"])
+        )
+
+def update_drift_state(conn, agent, ordered_rows, overall, timestamps):
+    """
+    Fold new overall scores into the agent's EWMA and two-sided CUSUM.
+    The first DRIFT_WARMUP rows only estimate the reference mean and std.
+    When either CUSUM crosses CUSUM_H the alarm is recorded and both sums
+    restart from zero, so a later shift is detected on its own.
+    """
+    if not ordered_rows:
+        return
+
+    row = conn.execute(
+        """SELECT n, mean, m2, reference_mean, reference_std, ewma, cusum_pos, cusum_neg,
+                  alarms, last_alarm, last_alarm_n, last_alarm_ts
+           FROM drift_state WHERE agent = ?""",
+        (agent,)
+    ).fetchone()
+    (n, mean, m2, ref_mean, ref_std, ewma, cusum_pos, cusum_neg,
+     alarms, last_alarm, last_alarm_n, last_alarm_ts) = row or (0, 0.0, 0.0, None, None, None, 0.0, 0.0,
+                                                               0, None, None, None)
+
+    for i in ordered_rows:
+        x = overall[i]
+        if ref_mean is None:
+            # Welford running mean/variance during warm-up
+            n += 1
+            delta = x - mean
+            mean += delta / n
+            m2 += delta * (x - mean)
+            if n >= DRIFT_WARMUP:
+                ref_mean = mean
+                ref_std = max((m2 / (n - 1)) ** 0.5, 1e-6)
+                ewma = ref_mean
+            continue
+
+        n += 1
+        ewma = EWMA_LAMBDA * x + (1 - EWMA_LAMBDA) * ewma
+        cusum_pos = max(0.0, cusum_pos + (x - ref_mean) / ref_std - CUSUM_K)
+        cusum_neg = max(0.0, cusum_neg + (ref_mean - x) / ref_std - CUSUM_K)
+        if cusum_pos > CUSUM_H or cusum_neg > CUSUM_H:
+            alarms += 1
+            last_alarm = "upward drift" if cusum_pos > CUSUM_H else "downward drift"
+            last_alarm_n = n
+            last_alarm_ts = timestamps[i]
+            cusum_pos = cusum_neg = 0.0
+
+    conn.execute(
+        "INSERT OR REPLACE INTO drift_state VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (agent, n, mean, m2, ref_mean, ref_std, ewma, cusum_pos, cusum_neg, timestamps[ordered_rows[-1]],
+         alarms, last_alarm, last_alarm_n, last_alarm_ts)
+    )
+
+def rebaseline(agent=None, path=HISTORY_PATH):
+    """
+    Restart drift detection for an agent (or all agents), e.g. after an
+    intended change in agent behaviour: the next DRIFT_WARMUP rows estimate
+    a new reference mean and std. The alarm history is kept.
+    """
+    conn = connect(path)
+    try:
+        with conn:
+            query = """UPDATE drift_state SET n = 0, mean = 0.0, m2 = 0.0, reference_mean = NULL,
+                       reference_std = NULL, ewma = NULL, cusum_pos = 0.0, cusum_neg = 0.0, last_alarm_n = NULL"""
+            if agent:
+                conn.execute(query + " WHERE agent = ?", (agent,))
+            else:
+                conn.execute(query)
+    finally:
+        conn.close()
+
+def drift_status(agent=None, path=HISTORY_PATH):
+    """
+    Current EWMA/CUSUM drift status per agent (or for one agent). A CUSUM
+    alarm stays reported for DRIFT_ALARM_HOLD rows after it fired.
+    """
+    conn = connect(path)
+    try:
+        query = """SELECT agent, n, reference_mean, reference_std, ewma, cusum_pos, cusum_neg,
+                          alarms, last_alarm, last_alarm_n, last_alarm_ts FROM drift_state"""
+        rows = conn.execute(query + " WHERE agent = ?", (agent,)).fetchall() if agent else conn.execute(query).fetchall()
+    finally:
+        conn.close()
+
+    status = {}
+    for name, n, ref_mean, ref_std, ewma, cusum_pos, cusum_neg, alarms, last_alarm, last_alarm_n, last_alarm_ts in rows:
+        if ref_mean is None:
+            status[name] = {"observations": n, "status": f"warming up ({n}/{DRIFT_WARMUP})", "alarms": alarms}
+            continue
+
+        ewma_limit = EWMA_LIMIT * ref_std * (EWMA_LAMBDA / (2 - EWMA_LAMBDA)) ** 0.5
+        if last_alarm_n is not None and n - last_alarm_n < DRIFT_ALARM_HOLD:
+            state = last_alarm
+        elif ewma > ref_mean + ewma_limit:
+            state = "upward drift"
+        elif ewma < ref_mean - ewma_limit:
+            state = "downward drift"
+        else:
+            state = "stable"
+        status[name] = {
+            "observations": n,
+            "reference_mean": round(ref_mean, 4),
+            "ewma": round(ewma, 4),
+            "cusum_pos": round(cusum_pos, 4),
+            "cusum_neg": round(cusum_neg, 4),
+            "alarms": alarms,
+            "last_alarm": {"status": last_alarm, "timestamp": last_alarm_ts} if last_alarm else None,
+            "status": state
+        }
+    return status
+
+def rolling_averages(agent, window_days=7, metric="overall", start_day=None, end_day=None, path=HISTORY_PATH):
+    """
+    Rolling-window average of a metric for an agent, one value per recorded
+    day, computed from the daily aggregates.
+    """
+    if metric != "overall" and metric not in METRIC_COLUMNS:
+        raise ValueError(f"Unknown metric: {metric}")
+
+    conn = connect(path)
+    try:
+        daily = conn.execute(
+            f"SELECT day, n, sum_{metric} FROM daily_aggregates WHERE agent = ? ORDER BY day", (agent,)
+        ).fetchall()
+    finally:
+        conn.close()
+
+    averages = []
+    window = []
+    count = total = 0
+    for day, n, day_sum in daily:
+        current = datetime.strptime(day, "%Y-%m-%d")
+        window.append((current, n, day_sum))
+        count += n
+        total += day_sum
+        while window[0][0] <= current - timedelta(days=window_days):
+            _, old_n, old_sum = window.pop(0)
+            count -= old_n
+            total -= old_sum
+        if (start_day is None or day >= start_day) and (end_day is None or day <= end_day):
+            averages.append({"day": day, "average": round(total / count, 4), "rows": count})
+    return averages
+
+def weekly_agent_deltas(metric="overall", path=HISTORY_PATH):
+    """
+    Shadow-minus-production average of a metric for every ISO week with
+    scores for both agents.
+    """
+    if metric != "overall" and metric not in METRIC_COLUMNS:
+        raise ValueError(f"Unknown metric: {metric}")
+
+    conn = connect(path)
+    try:
+        daily = conn.execute(
+            f"SELECT day, agent, n, sum_{metric} FROM daily_aggregates WHERE agent IN ('prodagent', 'shadagent')"
+        ).fetchall()
+    finally:
+        conn.close()
+
+    weeks = {}
+    for day, agent, n, day_sum in daily:
+        year, week, _ = datetime.strptime(day, "%Y-%m-%d").isocalendar()
+        totals = weeks.setdefault(f"{year}-W{week:02d}", {}).setdefault(agent, [0, 0.0])
+        totals[0] += n
+        totals[1] += day_sum
+
+    deltas = []
+    for week in sorted(weeks):
+        agents = weeks[week]
+        if "prodagent" in agents and "shadagent" in agents:
+            prod_avg = agents["prodagent"][1] / agents["prodagent"][0]
+            shad_avg = agents["shadagent"][1] / agents["shadagent"][0]
+            deltas.append({
+                "week": week,
+                "prodagent": round(prod_avg, 4),
+                "shadagent": round(shad_avg, 4),
+                "delta": round(shad_avg - prod_avg, 4)
+            })
+    return deltas